@@ -1,14 +1,21 @@
+import io
 import json
+import os
+import tempfile
 
 from UI.window import Window
 from UI.tkmenu import TkMenu
-from UI.colorizertext import ColorizerText
+from UI.virtualtext import VirtualText
+from UI.document import Document
+from UI.job import Job
+from tkinter import Scrollbar, Frame, Label, Button
 from tkinter.filedialog import asksaveasfilename, askopenfilename
 from tkinter.messagebox import askokcancel, showerror
 
 from compiler.compiler import Compiler
-from compiler.decompiler import Decompiler
+from compiler.decompiler import Decompiler, map_file
 from compiler.regexparser import Parser
+from compiler.batch import decompile_error_message
 
 
 class App:
@@ -16,12 +23,18 @@ class App:
         self.win = Window("Hex Writer", self.close)
         self.file = None
 
+        # The compile or load running on a worker thread, if any, and the document it reads
+        self.job = None
+        self.job_document = None
+
         try:
             self.win.option_readfile(style_path)
         except:
             pass
 
-        self.text = ColorizerText(self.win, font="consolas 12")
+        self.text = VirtualText(self.win, font="consolas 12")
+        self.scrollbar = Scrollbar(self.win)
+        self.text.set_scrollbar(self.scrollbar)
         self.menu = TkMenu(self.win,
                            ("New", "<Control-o>", self.new),
                            ("Open", "<Control-o>", self.open),
@@ -33,7 +46,14 @@ class App:
                            ("Compile", "<Control-p>", self.compile)
                            )
 
+        # Shown at the bottom while a job runs
+        self.status = Frame(self.win, bd=2, relief="sunken")
+        self.status_label = Label(self.status, anchor="w")
+        Button(self.status, text="Cancel", command=self.cancel_job, relief="flat").pack(side="right")
+        self.status_label.pack(side="left", fill="x", expand=True)
+
         self.menu.pack(side="top", fill="x")
+        self.scrollbar.pack(side="right", fill="y")
         self.text.pack(fill="both", expand=True)
 
     def close(self):
@@ -50,12 +70,15 @@ class App:
     def new(self):
         """Create a blank document"""
 
-        if self.file is not None or self.text.get("1.0", "end-1c") != "":
+        if self.file is not None or not self.text.get_document().is_empty():
             if not askokcancel("", "Any unsaved data will be lost"):
                 return 1
 
+        # A running compile may be reading the document about to be closed
+        self.cancel_job()
+
         self.file = None
-        self.text.delete("1.0", "end")
+        self.text.set_document(Document())
         self.win.title("")
 
     def open(self):
@@ -68,16 +91,20 @@ class App:
             if self.new():
                 return
 
-            with open(file, "r") as fp:
-                text = fp.read()
+            # The file is mapped rather than read, only the lines on screen are ever decoded
+            try:
+                document = Document.open(file)
+            except Exception as err:
+                showerror("", "Cannot open file:" + str(file) + "\nReason:" + str(err))
+                return
 
-            self.text.insert("end", text)
+            self.text.set_document(document)
 
             self.file = file
             self.win.title(file)
 
     def load(self):
-        """Ask to open a binary file and a rules.json file"""
+        """Ask to open a binary file and a rules.json file, then decompiles it on a worker thread"""
 
         file = askopenfilename()
         if not file:
@@ -96,29 +123,57 @@ class App:
             return
 
         try:
-            with open(file, "rb") as fp:
-                binary = fp.read()
+            size = os.path.getsize(file)
         except Exception as err:
             showerror("", "Cannot open file:" + str(file) + "\nReason:" + str(err))
             return
 
-        header = hw.get_header(rules)
+        def decompile(job):
+            # The script is written to a temporary file and opened as a document, so it is never one string
+            fp = tempfile.TemporaryFile()
+            path = []
 
-        try:
-            string, index = hw.decompile(rules, binary)
+            try:
+                with open(file, "rb") as binary_fp:
+                    binary = map_file(binary_fp)
+
+                writer = io.TextIOWrapper(fp, "UTF-8", newline="\n")
+                for line in hw.iter_script(rules, binary, path):
+                    writer.write(line)
+
+                    # The offset of the step being decoded
+                    if path:
+                        job.progress = (path[-1][1], size)
+                    job.check()
 
-            if index != len(binary):
-                string += "\n" + (" ".join("#" + hex(byte)[2:] for byte in binary[index:]))
+                writer.flush()
+                writer.detach()
 
+                # After an error the traceback still holds views of the map, so it is left to be freed with them
+                # rather than closed, which would raise over the error
+                if type(binary) != bytes:
+                    binary.close()
+
+            except BaseException:
+                fp.close()
+                raise
+
+            return fp
+
+        def done(fp):
             if self.new():
+                fp.close()
                 return
 
-            self.text.insert("1.0", header + "\n" + string)
+            self.text.set_document(Document.from_file(fp))
+
+        def error(err):
+            if isinstance(err, OSError):
+                showerror("", "Cannot open file:" + str(file) + "\nReason:" + str(err))
+            else:
+                showerror("", decompile_error_message(err))
 
-        except NameError as err:
-            showerror("", "Cannot find varname: " + str(err))
-        except TypeError as err:
-            showerror("", "Cannot find width: " + str(err))
+        self.start_job("Decompiling", decompile, done, error, "bytes")
 
     def save(self):
         """Saves the current file, if there is no current file, it call saveas"""
@@ -127,8 +182,14 @@ class App:
             return self.saveas()
 
         if self.file is not None:
-            with open(self.file, "w") as fp:
-                fp.write(self.text.get("1.0", "end"))
+            # Saving closes the file the document was read from, which a running compile may still be reading
+            if self.job is not None and self.job_document is not None:
+                self.cancel_job()
+
+            try:
+                self.text.get_document().save(self.file)
+            except Exception as err:
+                showerror("", "Could not write to file: " + str(self.file) + "\nReason:" + str(err))
 
     def saveas(self):
         """Ask the user to save a file"""
@@ -141,14 +202,23 @@ class App:
             self.save()
 
     def compile(self):
-        """Compiles the string to binary data, then ask the user to save the file"""
+        """Compiles the document to binary data on a worker thread, then ask the user to save the file"""
 
-        string = self.text.get("1.0", "end")
+        # Edits made while compiling do not change the copy being compiled
+        document = self.text.get_document().copy()
+        path = None if self.file is None else os.path.abspath(self.file)
         hw = Compiler("UTF-8", 4)
 
-        try:
-            byte_array = hw.compile(string)
+        def compile(job, lines_per_chunk=4096):
+            def chunks():
+                for n, chunk in enumerate(document.iter_chunks(lines_per_chunk)):
+                    job.progress = (n * lines_per_chunk, document.line_count())
+                    job.check()
+                    yield chunk
+
+            return hw.compile(chunks(), path)
 
+        def done(byte_array):
             output = asksaveasfilename()
 
             if output:
@@ -158,10 +228,47 @@ class App:
                 except Exception as err:
                     showerror("", "Could not write to file: " + str(output) + "\nReason:" + str(err))
 
-        except Parser.Error as err:
-            showerror("", "Unexpected " + repr(err.match.string) + " on line " + err.match.line)
-        except TypeError as err:
-            showerror("", "Unexpected group type:" + str(err))
-        except ValueError as err:
-            err = err.args
-            showerror("", "Unknown padding type: " + repr(err[0]) + " on line " + err[1])
+        def error(err):
+            if isinstance(err, Parser.Error):
+                showerror("", "Unexpected " + repr(err.match.string) + " on line " + str(err.match.line))
+            elif isinstance(err, Compiler.CompileError):
+                showerror("", str(err))
+            elif isinstance(err, TypeError):
+                showerror("", "Unexpected group type:" + str(err))
+            elif isinstance(err, ValueError) and len(err.args) == 2:
+                err = err.args
+                showerror("", "Unknown padding type: " + repr(err[0]) + " on line " + str(err[1]))
+            else:
+                showerror("", str(err))
+
+        self.start_job("Compiling", compile, done, error, "lines", document)
+
+    def start_job(self, name, function, on_done, on_error, unit, document=None):
+        """Runs a function on a worker thread, showing its progress in the status bar until it finishes, document is
+        the document it reads if any"""
+
+        self.cancel_job()
+        self.job_document = document
+
+        def progress(done, total):
+            percent = 100 * done // total if total else 0
+            self.status_label.config(text="%s: %d of %d %s (%d%%)" % (name, done, total, unit, percent))
+
+        def finish(callback):
+            def wrapper(result):
+                self.job = None
+                self.status.pack_forget()
+                callback(result)
+            return wrapper
+
+        progress(0, 0)
+        self.status.pack(side="bottom", fill="x", before=self.scrollbar)
+        self.job = Job(self.win, function, finish(on_done), finish(on_error), progress).start()
+
+    def cancel_job(self):
+        """Stops the running job, if there is one"""
+
+        if self.job is not None:
+            self.job.cancel()
+            self.job = None
+            self.status.pack_forget()
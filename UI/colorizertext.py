@@ -1,55 +1,280 @@
+import bisect
+import queue
+import threading
 from tkinter import *
-from compiler.regexparser import Parser
-from compiler.consts import REGEX
+from compiler.regexparser import Parser, IncrementalScanner
+from compiler.consts import REGEX, PARTIAL_REGEX
 
 
 class ColorizerText(Text):
-    def __init__(self, master, **kwargs):
+    def __init__(self, master, async_size=50000, delay=150, batch_size=2000, **kwargs):
         Text.__init__(self, master, **kwargs)
 
         self._orig = self._w + "_orig"
         self.tk.call("rename", self._w, self._orig)
         self.tk.createcommand(self._w, self._proxy)
 
-        self.bind("<<TextModified>>", self.colorize)
-        self.parser = Parser(REGEX)
+        self.parser = Parser(REGEX, partial=PARTIAL_REGEX)
+        self.scanner = IncrementalScanner(self.parser, remove=["white_space"])
+
+        # A known index and its character offset, used to turn offsets near the last edit into indexes
+        self._anchor = ("1.0", 0)
+
+        # The number of characters in the widget, kept up to date from the size of each edit
+        self._length = self._count("1.0", "end")
+
+        # Documents and edits larger than async_size characters are colorized on a worker thread once no edit
+        # has been made for delay milliseconds, applying batch_size tags at a time
+        self.async_size = async_size
+        self.delay = delay
+        self.batch_size = batch_size
+
+        self._generation = 0
+        self._pending = False
+        self._debounce = None
+        self._results = queue.Queue()
+        self._batches = None
 
         self.tag_config("def", foreground="white")
         self.tag_config("sizedef", foreground="white")
         self.tag_config("pad", foreground="blue")
+        self.tag_config("directive", foreground="blue")
         self.tag_config("int", foreground="orange")
         self.tag_config("float", foreground="orange")
+        self.tag_config("array", foreground="orange")
         self.tag_config("var", foreground="purple")
         self.tag_config("str", foreground="green")
         self.tag_config("comment", foreground="dark grey")
         self.tag_config("miss_match_error", background="red")
 
+        self.colorize()
+
     def _proxy(self, command, *args):
         """Proxy callback"""
 
         cmd = (self._orig, command) + args
+        edit = None
+
         try:
+            if command in ("insert", "delete", "replace"):
+                edit = self._edit_start(command, args)
+
             result = self.tk.call(cmd)
         except Exception as err:
             # This is needed as when you press CTRL+A then CTRL+V it crashes
             print(cmd, err)
             return
 
-        if command in ("insert", "delete", "replace"):
+        if edit is not None:
+            # Deleting several ranges at once is not a single edit
+            if command == "delete" and len(args) > 2:
+                self._length = self._count("1.0", "end")
+                self.colorize()
+            else:
+                self.highlight_edit(*edit)
+
             self.event_generate("<<TextModified>>")
 
         return result
 
+    def _edit_start(self, command, args):
+        """Finds the index, character offset, removed characters and inserted characters of an edit before it is
+        made, the offset is None while a background pass is on its way as the anchor is out of date"""
+
+        index = self.tk.call(self._orig, "index", args[0])
+
+        if command == "insert":
+            removed = 0
+            inserted = sum(len(chars) for chars in args[1::2])
+        elif command == "delete":
+            index, removed = self._removed(index, args[1] if len(args) > 1 else "%s+1c" % index)
+            inserted = 0
+        else:
+            index, removed = self._removed(index, args[1])
+            inserted = sum(len(chars) for chars in args[2::2])
+
+        if self.tk.call(self._orig, "compare", index, ">", "end-1c"):
+            index = self.tk.call(self._orig, "index", "end-1c")
+
+        return index, None if self.colorizing() else self._offset(index), removed, inserted
+
+    def _removed(self, index1, index2):
+        """Finds where Tk starts deleting between two indexes and the number of characters it deletes, it never
+        deletes the final newline so a range from the start of a line to the end deletes the newline before it"""
+
+        index2 = self.tk.call(self._orig, "index", index2)
+        if not self.tk.call(self._orig, "compare", index1, "<", index2):
+            return index1, 0
+
+        removed = self._count(index1, index2)
+        if self.tk.call(self._orig, "compare", index2, "==", "end"):
+            if index1 != "1.0" and index1.endswith(".0"):
+                return self.tk.call(self._orig, "index", "%s-1c" % index1), removed
+
+            removed -= 1
+
+        return index1, removed
+
+    def _count(self, index1, index2):
+        """Counts the characters between two indexes, negative if the second is before the first"""
+
+        return int(self.tk.call(self._orig, "count", "-chars", index1, index2) or 0)
+
+    def _offset(self, index):
+        """Converts an index into a character offset by counting from the last edit"""
+
+        anchor_index, anchor = self._anchor
+        return anchor + self._count(anchor_index, index)
+
+    def _index(self, offset):
+        """Converts a character offset into an index relative to the last edit"""
+
+        index, anchor = self._anchor
+        return "%s%+dc" % (index, offset - anchor)
+
+    def _get_text(self, start, end):
+        """Gets the text between two character offsets"""
+
+        return self.tk.call(self._orig, "get", self._index(start), self._index(end))
+
+    def highlight_edit(self, index, start, removed, inserted):
+        """Re-colors the tokens around an edit, leaving the tags of the tokens the edit could not change"""
+
+        self._length += inserted - removed
+
+        # While a background pass is on its way the scanner is out of date, so start the pass again
+        if start is None or inserted > self.async_size:
+            self.colorize_async()
+            return
+
+        self._anchor = (index, start)
+        begin, end, tokens = self.scanner.edit(start, removed, inserted, self._get_text)
+
+        self._retag(begin, end, tokens)
+
     def colorize(self, event=None):
         """Scans through text and highlights all found words"""
 
+        if self._length > self.async_size:
+            self.colorize_async()
+            return
+
+        self._cancel()
+        self._anchor = ("1.0", 0)
+        tokens = self.scanner.reset(self.get("1.0", "end"))
+        self._length = self.scanner.length
+
+        self._retag(0, self.scanner.length, tokens)
+
+    def colorize_async(self):
+        """Colorizes the whole document on a worker thread once there have been no edits for a short delay"""
+
+        self._cancel()
+        self._pending = True
+        self._debounce = self.after(self.delay, self._start_pass)
+
+    def colorizing(self):
+        """Checks if a background pass is waiting, scanning or still tagging"""
+
+        return self._pending
+
+    def _cancel(self):
+        """Stops any background pass, a worker that is still scanning discards its tokens"""
+
+        self._generation += 1
+        self._pending = False
+        self._batches = None
+
+        if self._debounce is not None:
+            self.after_cancel(self._debounce)
+            self._debounce = None
+
+    def _start_pass(self):
+        """Snapshots the document and starts scanning it on a worker thread"""
+
+        self._debounce = None
+        generation = self._generation
         text = self.get("1.0", "end")
 
-        tokens = self.parser.scan(text, remove=["white_space"], ignore_errors=True)
+        # Tag the part of the document on screen first, its indexes are turned into offsets by the worker
+        visible = (self.index("@0,0"), self.index("@0,%d" % self.winfo_height()))
+
+        scanner = IncrementalScanner(self.parser, remove=self.scanner.remove, partial=self.scanner.partial)
+        threading.Thread(target=self._scan_pass, args=(scanner, text, generation, visible), daemon=True).start()
+
+        self._poll(generation)
+
+    def _scan_pass(self, scanner, text, generation, visible):
+        """Runs on the worker thread, scanning a snapshot of the document"""
+
+        visible = tuple(self._text_offset(text, index) for index in visible)
+        if scanner.reset(text, lambda: generation != self._generation) is not None:
+            self._results.put((generation, scanner, visible))
+
+    @staticmethod
+    def _text_offset(text, index):
+        """Converts a line.column index into a character offset in a snapshot of the document"""
 
+        line, column = map(int, str(index).split("."))
+        return len(text) - len(text.split("\n", line - 1)[-1]) + column
+
+    def _poll(self, generation):
+        """Waits on the Tk thread for the worker to finish, then applies its tags a batch at a time"""
+
+        # A newer pass has taken over
+        if generation != self._generation:
+            return
+
+        while self._batches is None:
+            try:
+                result_generation, scanner, visible = self._results.get_nowait()
+            except queue.Empty:
+                self.after(20, self._poll, generation)
+                return
+
+            # The document has not changed since this pass took its snapshot
+            if result_generation == generation:
+                self.scanner = scanner
+                self._anchor = ("1.0", 0)
+                self._batches = self._iter_batches(visible)
+
+        for begin, end, tokens in self._batches:
+            self._retag(begin, end, tokens)
+            self.after(1, self._poll, generation)
+            return
+
+        self._batches = None
+        self._pending = False
+
+    def _iter_batches(self, visible):
+        """Splits the scanner's tokens into (begin, end, tokens) batches, starting with the visible ones"""
+
+        tokens = self.scanner.tokens()
+        starts = [0] + [token[0] for token in tokens[self.batch_size::self.batch_size]] + [self.scanner.length]
+
+        batches = [
+            (starts[n], starts[n + 1], tokens[n * self.batch_size: (n + 1) * self.batch_size])
+            for n in range(len(starts) - 1)
+        ]
+
+        first = bisect.bisect_right(starts, visible[0]) - 1
+        last = bisect.bisect_right(starts, visible[1])
+
+        yield from batches[first:last]
+        yield from batches[:first]
+        yield from batches[last:]
+
+    def _retag(self, begin, end, tokens):
+        """Replaces the tags between two character offsets with the tags of the tokens"""
+
+        start_index, end_index = self._index(begin), self._index(end)
         for tag in REGEX:
-            self.tag_remove(tag, "1.0", "end")
-        self.tag_remove("miss_match_error", "1.0", "end")
+            self.tag_remove(tag, start_index, end_index)
+        self.tag_remove(self.parser.error_name, start_index, end_index)
+
+        for start, end, group in tokens:
+            start_index = self.tk.call(self._orig, "index", self._index(start))
+            self.tag_add(group, start_index, "%s+%dc" % (start_index, end - start))
 
-        for token in tokens:
-            self.tag_add(token.group, "1.0+%sc" % token.start, "1.0+%sc" % token.end)
+            # Move the anchor along so the next index is counted from this token rather than the last edit
+            self._anchor = (start_index, start)
@@ -0,0 +1,247 @@
+import bisect
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from compiler.decompiler import map_file
+
+
+class LineFile:
+    """The lines of a file read straight from a memory map, the file is only scanned to count its lines and only the
+    lines asked for are decoded"""
+
+    # Lines are found a chunk of the file at a time, keeping the positions of the newlines of a few chunks
+    chunk_size = 1 << 20
+    cached_chunks = 16
+
+    def __init__(self, fp, encoding="UTF-8"):
+        self.fp = fp
+        self.data = map_file(fp)
+        self.encoding = encoding
+
+        # The number of newlines before each chunk
+        self.chunk_newlines = [0]
+        for start in range(0, len(self.data), self.chunk_size):
+            newlines = self.data[start: start + self.chunk_size].count(b"\n")
+            self.chunk_newlines.append(self.chunk_newlines[-1] + newlines)
+
+        self.count = self.chunk_newlines[-1] + 1
+        self.newlines = OrderedDict()
+
+        # A copy of the document may be read by a worker thread while the editor reads it
+        self.lock = threading.Lock()
+
+    def chunk(self, n) -> list:
+        """Gets the offsets of the newlines in chunk n"""
+
+        with self.lock:
+            if n in self.newlines:
+                self.newlines.move_to_end(n)
+                return self.newlines[n]
+
+        start = n * self.chunk_size
+        offsets = [start + match.start() for match in re.finditer(b"\n", self.data[start: start + self.chunk_size])]
+
+        with self.lock:
+            self.newlines[n] = offsets
+            if len(self.newlines) > self.cached_chunks:
+                self.newlines.popitem(last=False)
+
+        return offsets
+
+    def line_start(self, n) -> int:
+        """Gets the offset line n starts at"""
+
+        if n == 0:
+            return 0
+
+        # Line n starts after newline n - 1
+        chunk = bisect.bisect_right(self.chunk_newlines, n - 1) - 1
+        return self.chunk(chunk)[n - 1 - self.chunk_newlines[chunk]] + 1
+
+    def get_lines(self, start, stop) -> list:
+        """Decodes lines start to stop without their line endings"""
+
+        if start >= stop:
+            return []
+
+        # The newline ending the last line is included so a \r before it is removed with it
+        end = len(self.data) if stop >= self.count else self.line_start(stop)
+        # Bytes that do not decode are kept as surrogates, so saving the lines writes them back unchanged
+        text = str(self.data[self.line_start(start): end], self.encoding, "surrogateescape")
+        lines = text.replace("\r\n", "\n").split("\n")
+
+        return lines if stop >= self.count else lines[:-1]
+
+    def reopen(self):
+        """Opens and maps the file again after it was closed, its lines have not changed so the newlines already
+        found are kept"""
+
+        self.fp = open(self.fp.name, "rb")
+        self.data = map_file(self.fp)
+
+    def close(self):
+        if type(self.data) != bytes:
+            self.data.close()
+        self.fp.close()
+
+
+class Document:
+    """The lines of a document as a piece table, the pieces are ranges of the lines of the file it was opened from
+    or of lists of lines edited in, so a large file is never held in memory and edits never copy it"""
+
+    def __init__(self, lines=None):
+        self.source = None
+
+        # Each piece is (lines, first line, number of lines), and starts holds the document line each piece starts at
+        self.pieces = []
+        self.starts = []
+        self.count = 0
+
+        self.replace_lines(0, 0, [""] if lines is None else lines)
+
+    @staticmethod
+    def open(path, encoding="UTF-8"):
+        """Opens a file as a document without reading it"""
+
+        return Document.from_file(open(path, "rb"), encoding)
+
+    @staticmethod
+    def from_file(fp, encoding="UTF-8"):
+        """Creates a document of the lines of an open binary file, which the document closes when it is closed"""
+
+        document = Document([])
+        document.source = LineFile(fp, encoding)
+        document.pieces = [(document.source, 0, document.source.count)]
+        document.starts = [0]
+        document.count = document.source.count
+        return document
+
+    def copy(self):
+        """Copies the document as it is now without copying its lines, as edits never change the lines of a piece,
+        the copy does not close the file when it is closed"""
+
+        document = Document([])
+        document.pieces = self.pieces.copy()
+        document.starts = self.starts.copy()
+        document.count = self.count
+        return document
+
+    def line_count(self) -> int:
+        return self.count
+
+    def is_empty(self) -> bool:
+        return self.count == 1 and self.get_lines(0, 1) == [""]
+
+    def get_lines(self, start, stop) -> list:
+        """Gets lines start to stop without their line endings"""
+
+        start = max(start, 0)
+        stop = min(stop, self.count)
+        lines = []
+
+        n = bisect.bisect_right(self.starts, start) - 1
+        while start < stop:
+            source, first, count = self.pieces[n]
+            offset = start - self.starts[n]
+            end = min(count, offset + stop - start)
+
+            if type(source) == list:
+                lines.extend(source[first + offset: first + end])
+            else:
+                lines.extend(source.get_lines(first + offset, first + end))
+
+            start += end - offset
+            n += 1
+
+        return lines
+
+    def split(self, line) -> int:
+        """Splits the piece holding a line so a piece starts at it, returning the index of that piece"""
+
+        if line >= self.count:
+            return len(self.pieces)
+
+        n = bisect.bisect_right(self.starts, line) - 1
+        if self.starts[n] == line:
+            return n
+
+        source, first, count = self.pieces[n]
+        offset = line - self.starts[n]
+
+        self.pieces[n: n + 1] = [(source, first, offset), (source, first + offset, count - offset)]
+        self.starts.insert(n + 1, line)
+        return n + 1
+
+    def replace_lines(self, start, stop, lines):
+        """Replaces lines start to stop with a list of lines"""
+
+        start = min(max(start, 0), self.count)
+        stop = min(max(stop, start), self.count)
+
+        first = self.split(start)
+        last = self.split(stop)
+
+        pieces = [(list(lines), 0, len(lines))] if lines else []
+        self.pieces[first: last] = pieces
+
+        # A document always has at least one line, even if it is empty
+        if not self.pieces:
+            self.pieces = [([""], 0, 1)]
+
+        self.starts = []
+        self.count = 0
+        for source, _, count in self.pieces:
+            self.starts.append(self.count)
+            self.count += count
+
+    def iter_chunks(self, lines_per_chunk=4096):
+        """Yields the text of the document a chunk of lines at a time, for saving or compiling it without joining
+        it into one string"""
+
+        for start in range(0, self.count, lines_per_chunk):
+            text = "\n".join(self.get_lines(start, start + lines_per_chunk))
+            yield text if start == 0 else "\n" + text
+
+    def get_text(self) -> str:
+        return "".join(self.iter_chunks())
+
+    def save(self, path, encoding="UTF-8"):
+        """Writes the document to a file through a temporary file, as the file may be the one it is reading from,
+        the document then reads its lines from the saved file"""
+
+        temp_path = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            with open(temp_path, "w", encoding=encoding, errors="surrogateescape") as fp:
+                fp.writelines(self.iter_chunks())
+
+            # Windows cannot replace a file that is open and mapped, so the file being read is closed until the
+            # saved file has replaced it, or opened again if it could not be
+            if self.source is not None:
+                self.source.close()
+            try:
+                os.replace(temp_path, path)
+            except BaseException:
+                if self.source is not None:
+                    self.source.reopen()
+                raise
+
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+        self.source = LineFile(open(path, "rb"), encoding)
+        self.pieces = [(self.source, 0, self.source.count)]
+        self.starts = [0]
+        self.count = self.source.count
+
+    def close(self):
+        """Closes the file the document was opened from"""
+
+        if self.source is not None:
+            self.source.close()
+            self.source = None
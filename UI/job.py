@@ -0,0 +1,81 @@
+import queue
+import threading
+
+
+class Job:
+    """Runs a function on a worker thread, handing its result or error back to callbacks on the Tk thread
+
+    The function is called with the job, it sets job.progress to (done, total) as it goes and calls job.check()
+    often, which raises Job.Cancelled once the job is cancelled so the function stops where it is"""
+
+    class Cancelled(Exception):
+        pass
+
+    def __init__(self, widget, function, on_done, on_error=None, on_progress=None, interval=50):
+        self.widget = widget
+        self.function = function
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self.interval = interval
+
+        self.progress = (0, 0)
+        self.cancelled = False
+        self.finished = False
+
+        self._results = queue.Queue()
+        self._poll_id = None
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        self._poll_id = self.widget.after(self.interval, self._poll)
+        return self
+
+    def check(self):
+        """Called by the function, raises Job.Cancelled if the job was cancelled"""
+
+        if self.cancelled:
+            raise Job.Cancelled()
+
+    def cancel(self):
+        """Stops the job, its callbacks are not called after this, even if the function has already finished"""
+
+        self.cancelled = True
+        self.finished = True
+
+        if self._poll_id is not None:
+            self.widget.after_cancel(self._poll_id)
+            self._poll_id = None
+
+    def running(self) -> bool:
+        return not self.finished
+
+    def _run(self):
+        """Runs on the worker thread"""
+
+        try:
+            self._results.put((True, self.function(self)))
+        except BaseException as err:
+            self._results.put((False, err))
+
+    def _poll(self):
+        """Runs on the Tk thread, reporting progress until the function has finished"""
+
+        self._poll_id = None
+        if self.cancelled:
+            return
+
+        try:
+            ok, result = self._results.get_nowait()
+        except queue.Empty:
+            if self.on_progress is not None:
+                self.on_progress(*self.progress)
+            self._poll_id = self.widget.after(self.interval, self._poll)
+            return
+
+        self.finished = True
+
+        if ok:
+            self.on_done(result)
+        elif self.on_error is not None and not isinstance(result, Job.Cancelled):
+            self.on_error(result)
@@ -0,0 +1,164 @@
+from UI.colorizertext import ColorizerText
+from UI.document import Document
+
+
+class VirtualText(ColorizerText):
+    """A ColorizerText showing a window of the lines of a Document, the lines around the view are loaded into the
+    widget as it scrolls so only they are ever in Tk or colorized, however long the document is
+
+    Edits are written back to the document when the window moves, the scrollbar given to set_scrollbar scrolls
+    through the whole document. Tokens are scanned from the top of the window, so a comment or string that starts
+    above it is not colored as one"""
+
+    def __init__(self, master, document=None, window_size=3000, margin=1000, **kwargs):
+        ColorizerText.__init__(self, master, **kwargs)
+
+        # The number of lines loaded into the widget, and how close to either end of them the view gets before
+        # the window is moved to be around it again
+        self.window_size = window_size
+        self.margin = margin
+
+        self.document = None
+        self.window_start = 0
+        self.window_count = 0
+
+        # Whether the lines in the widget were edited since they were loaded
+        self.modified = False
+
+        self.scrollbar = None
+        self._loading = False
+        self._moving = None
+
+        self.bind("<<TextModified>>", self._on_modified, add=True)
+        self.bind("<Control-Home>", lambda event: self._jump(0), add=True)
+        self.bind("<Control-End>", lambda event: self._jump(self.line_count() - 1), add=True)
+        self.configure(yscrollcommand=self._on_scroll)
+
+        self.set_document(Document() if document is None else document)
+
+    def set_scrollbar(self, scrollbar):
+        """Makes a scrollbar scroll through the whole document"""
+
+        self.scrollbar = scrollbar
+        scrollbar.configure(command=self.scroll_document)
+
+    def set_document(self, document):
+        """Shows a document from its first line, closing the document shown before it"""
+
+        if self.document is not None and self.document is not document:
+            self.document.close()
+
+        self.document = document
+        self.window_start = 0
+        self.window_count = 0
+        self.modified = False
+        self._load(0)
+        self.mark_set("insert", "1.0")
+        self.yview_moveto(0)
+
+    def get_document(self) -> Document:
+        """Gets the document with the edits made in the widget written back to it"""
+
+        self.flush()
+        return self.document
+
+    def line_count(self) -> int:
+        """Counts the lines of the document including the edits in the widget not yet written back to it"""
+
+        return self.document.line_count() - self.window_count + self._widget_lines()
+
+    def flush(self):
+        """Writes the lines in the widget back to the document if they were edited"""
+
+        if not self.modified:
+            return
+
+        lines = self.get("1.0", "end-1c").split("\n")
+        self.document.replace_lines(self.window_start, self.window_start + self.window_count, lines)
+        self.window_count = len(lines)
+        self.modified = False
+
+    def show_line(self, line):
+        """Scrolls the view so a document line is at its top, moving the window if it is close to either end"""
+
+        line = max(0, min(line, self.line_count() - 1))
+        offset = line - self.window_start
+
+        near_start = offset < self.margin and self.window_start > 0
+        near_end = offset > self.window_count - self.margin and \
+            self.window_start + self.window_count < self.line_count()
+
+        if offset < 0 or offset >= self.window_count or near_start or near_end:
+            self._load(max(0, line - self.margin))
+
+        self.yview("%d.0" % (line - self.window_start + 1))
+
+    def scroll_document(self, *args):
+        """Scrollbar command, moving to a fraction of the whole document or scrolling the widget"""
+
+        if args[0] == "moveto":
+            self.show_line(int(float(args[1]) * self.line_count()))
+        else:
+            self.yview(*args)
+
+    def _jump(self, line):
+        """Moves the view and the insert cursor to a document line"""
+
+        self.show_line(line)
+        self.mark_set("insert", "%d.0" % (line - self.window_start + 1))
+        return "break"
+
+    def _widget_lines(self) -> int:
+        return int(self.index("end-1c").split(".")[0])
+
+    def _load(self, start):
+        """Loads the window of lines from a document line into the widget, keeping the insert cursor on the same
+        document line if it is still in the window"""
+
+        self.flush()
+
+        line, column = map(int, self.index("insert").split("."))
+        insert = self.window_start + line - 1
+
+        self.window_start = start
+        lines = self.document.get_lines(start, start + self.window_size)
+        self.window_count = len(lines)
+
+        self._loading = True
+        try:
+            self.delete("1.0", "end")
+            self.insert("1.0", "\n".join(lines))
+        finally:
+            self._loading = False
+
+        self.modified = False
+
+        if start <= insert < start + self.window_count:
+            self.mark_set("insert", "%d.%d" % (insert - start + 1, column))
+
+    def _on_modified(self, event=None):
+        if not self._loading:
+            self.modified = True
+
+    def _on_scroll(self, first, last):
+        """Called by Tk as the widget scrolls, moves the window once the view nears either end of it and updates the
+        scrollbar with where the view is in the whole document"""
+
+        top = self.window_start + int(self.index("@0,0").split(".")[0]) - 1
+        bottom = self.window_start + int(self.index("@0,%d" % self.winfo_height()).split(".")[0])
+        count = max(self.line_count(), 1)
+
+        if self.scrollbar is not None:
+            self.scrollbar.set(top / count, min(bottom / count, 1.0))
+
+        near_start = top - self.window_start < self.margin // 2 and self.window_start > 0
+        near_end = self.window_start + self.window_count - bottom < self.margin // 2 and \
+            self.window_start + self.window_count < count
+
+        # Moving the window scrolls the widget, so it is moved once Tk has finished this scroll
+        if (near_start or near_end) and self._moving is None:
+            self._moving = self.after_idle(self._move, top)
+
+    def _move(self, top):
+        self._moving = None
+        self.show_line(top)
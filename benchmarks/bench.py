@@ -0,0 +1,214 @@
+"""Measures the throughput and peak memory of the compiler, decompiler and highlighter over generated inputs
+
+Run with `python -m benchmarks.bench` from the repository root, --help lists the options"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from benchmarks import corpus
+from compiler.compiler import Compiler
+from compiler.consts import REGEX, PARTIAL_REGEX
+from compiler.decompiler import Decompiler
+from compiler.regexparser import Parser, IncrementalScanner
+
+
+class Benchmark:
+    """A named measurement over inputs of several sizes, `setup(size)` returns the input and its (unit, count) and
+    `run(data)` processes it once"""
+
+    def __init__(self, name, unit, setup, run):
+        self.name = name
+        self.unit = unit
+        self.setup = setup
+        self.run = run
+
+
+def scan_setup(size):
+    text = corpus.script(size)
+    return text, len(text.encode()), len(Parser(REGEX).scan(text, remove=["white_space"]))
+
+
+def scan_run(text):
+    Parser(REGEX).scan(text, remove=["white_space", "comment"])
+
+
+def compile_run(text):
+    Compiler().compile(text)
+
+
+def module_setup(size):
+    binary = corpus.module_binary(size)
+    return binary, len(binary), size
+
+
+def switch_setup(size):
+    binary = corpus.switch_binary(size)
+    return binary, len(binary), size
+
+
+def module_run(binary):
+    Decompiler().decompile_to(corpus.MODULE_RULES, binary, io.StringIO())
+
+
+def switch_run(binary):
+    Decompiler().decompile_to(corpus.SWITCH_RULES, binary, io.StringIO())
+
+
+def highlight_benchmark():
+    """Benchmarks ColorizerText.colorize when Tk can open a display, otherwise the IncrementalScanner pass that
+    colorize runs"""
+
+    try:
+        import tkinter
+        root = tkinter.Tk()
+        root.withdraw()
+    except Exception:
+        root = None
+
+    if root is None:
+        def run(text):
+            IncrementalScanner(Parser(REGEX, partial=PARTIAL_REGEX), remove=["white_space"]).reset(text)
+
+        return Benchmark("highlight_scan", "tokens", scan_setup, run)
+
+    from UI.colorizertext import ColorizerText
+
+    # Colorize synchronously so the whole pass is timed
+    widget = ColorizerText(root, async_size=float("inf"))
+
+    def run(text):
+        widget.delete("1.0", "end")
+        widget.insert("1.0", text)
+        widget.colorize()
+
+    return Benchmark("highlight", "tokens", scan_setup, run)
+
+
+def benchmarks():
+    """Returns every benchmark"""
+
+    return [
+        Benchmark("scan", "tokens", scan_setup, scan_run),
+        Benchmark("compile", "tokens", scan_setup, compile_run),
+        Benchmark("decompile_modules", "records", module_setup, module_run),
+        Benchmark("decompile_switch", "records", switch_setup, switch_run),
+        highlight_benchmark(),
+    ]
+
+
+def measure(benchmark, size, repeat, memory):
+    """Runs a benchmark at one size, timing the best of repeat runs then measuring peak memory in a separate run
+    as tracing slows it down"""
+
+    data, n_bytes, count = benchmark.setup(size)
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        benchmark.run(data)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+
+    result = {
+        "benchmark": benchmark.name,
+        "size": size,
+        "bytes": n_bytes,
+        benchmark.unit: count,
+        "seconds": best,
+        "mb_per_s": n_bytes / best / 1e6 if best else None,
+        benchmark.unit + "_per_s": count / best if best else None,
+        "peak_bytes": None,
+    }
+
+    if memory:
+        tracemalloc.start()
+        benchmark.run(data)
+        result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return result
+
+
+def version():
+    """Gets the git commit being benchmarked, or None outside of a checkout"""
+
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(result):
+    unit = "tokens" if "tokens" in result else "records"
+    peak = "" if result["peak_bytes"] is None else "%10.1f MB peak" % (result["peak_bytes"] / 1e6)
+
+    print("%-18s %9d %10.4fs %9.2f MB/s %12.0f %s/s%s" % (
+        result["benchmark"], result["size"], result["seconds"], result["mb_per_s"], result[unit + "_per_s"], unit,
+        peak))
+
+
+def compare(results, baseline_path):
+    """Prints the speed up of each result against the same benchmark and size in an earlier report"""
+
+    with open(baseline_path) as fp:
+        baseline = json.load(fp)
+
+    old = {(result["benchmark"], result["size"]): result for result in baseline["results"]}
+    print()
+    print("Compared to", baseline_path, "(" + str(baseline.get("version")) + ")")
+
+    for result in results:
+        key = (result["benchmark"], result["size"])
+        if key in old and result["seconds"]:
+            print("%-18s %9d %8.2fx" % (key[0], key[1], old[key]["seconds"] / result["seconds"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the compiler, decompiler and highlighter")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="comma separated token or record counts to run each benchmark at")
+    parser.add_argument("--only", default=None, help="comma separated benchmark names to run")
+    parser.add_argument("--repeat", type=int, default=3, help="runs to take the best time of")
+    parser.add_argument("--no-memory", action="store_true", help="skip measuring peak memory")
+    parser.add_argument("--out", default=None, help="writes a JSON report to this file")
+    parser.add_argument("--compare", default=None, help="compares against an earlier JSON report")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    only = None if args.only is None else args.only.split(",")
+
+    results = []
+    for benchmark in benchmarks():
+        if only is not None and benchmark.name not in only:
+            continue
+
+        for size in sizes:
+            result = measure(benchmark, size, args.repeat, not args.no_memory)
+            print_result(result)
+            results.append(result)
+
+    report = {
+        "version": version(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+    if args.out is not None:
+        with open(args.out, "w") as fp:
+            json.dump(report, fp, indent=4)
+
+    if args.compare is not None:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
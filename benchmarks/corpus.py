@@ -0,0 +1,108 @@
+import random
+import struct
+
+# Rules for records like rules.json's @module, each with a length prefixed name and a counted list of fields
+MODULE_RULES = {
+    "format": "[u32] $count; [@module:$count]",
+    "structs": {
+        "@module": "[byte]h $length; [byte:$length]s; [u16] $fields; [@field:$fields]",
+        "@field": "[byte]x; [u32]; [u16]b"
+    },
+    "sizes": {},
+    "defines": {},
+}
+
+# Rules for records that pick one of several structs from a kind byte
+SWITCH_RULES = {
+    "format": "[u32] $count; [@record:$count]",
+    "structs": {
+        "@record": "[byte] $kind; [0=@small,1=@large,2=@text,3=@pair]? $kind",
+        "@small": "[byte]",
+        "@large": "[long]x",
+        "@text": "[byte] $length; [byte:$length]s",
+        "@pair": "[u16]; [i32]"
+    },
+    "sizes": {},
+    "defines": {},
+}
+
+WORDS = ["alpha", "beta", "gamma", "delta", "header", "payload", "module", "entry"]
+
+
+def script(tokens, seed=0) -> str:
+    """Generates a hw script with about `tokens` tokens mixing pads, numbers, strings, comments and definitions"""
+
+    rand = random.Random(seed)
+    lines = ["$magic=[u32] #7f454c46", "@word=2"]
+    count = 0
+
+    while count < tokens:
+        kind = rand.randrange(8)
+
+        if kind == 0:
+            lines.append("[%s] %+d %+d" % (rand.choice(["u8", "u16", "u32", "word"]), rand.randrange(100),
+                                           rand.randrange(100)))
+            count += 3
+        elif kind == 1:
+            lines.append("[u16] #%x #%x" % (rand.randrange(0x7fff), rand.randrange(0x7fff)))
+            count += 3
+        elif kind == 2:
+            lines.append("[8] %d.%d" % (rand.randrange(1000), rand.randrange(1000)))
+            count += 2
+        elif kind == 3:
+            lines.append("[byte] %s" % "".join(rand.choice("01") for _ in range(7)))
+            count += 2
+        elif kind == 4:
+            lines.append(repr(" ".join(rand.choice(WORDS) for _ in range(rand.randrange(1, 5)))))
+            count += 1
+        elif kind == 5:
+            lines.append("/* %s */" % rand.choice(WORDS))
+            count += 1
+        elif kind == 6:
+            lines.append("magic")
+            count += 1
+        else:
+            lines.append("[u32] %+d" % rand.randrange(-2 ** 31, 2 ** 31))
+            count += 2
+
+    return "\n".join(lines) + "\n"
+
+
+def module_binary(records, seed=0) -> bytes:
+    """Generates a binary of `records` MODULE_RULES records, each nesting a few field records"""
+
+    rand = random.Random(seed)
+    parts = [records.to_bytes(4, "big")]
+
+    for _ in range(records):
+        name = rand.choice(WORDS).encode()
+        fields = rand.randrange(1, 4)
+        parts.append(bytes([len(name)]) + name + fields.to_bytes(2, "big"))
+
+        for _ in range(fields):
+            parts.append(struct.pack(">BIH", rand.randrange(256), rand.randrange(2 ** 32), rand.randrange(2 ** 16)))
+
+    return b"".join(parts)
+
+
+def switch_binary(records, seed=0) -> bytes:
+    """Generates a binary of `records` SWITCH_RULES records, choosing a struct for each one at random"""
+
+    rand = random.Random(seed)
+    parts = [records.to_bytes(4, "big")]
+
+    for _ in range(records):
+        kind = rand.randrange(4)
+        parts.append(bytes([kind]))
+
+        if kind == 0:
+            parts.append(bytes([rand.randrange(128)]))
+        elif kind == 1:
+            parts.append(rand.randrange(2 ** 63).to_bytes(8, "big"))
+        elif kind == 2:
+            text = rand.choice(WORDS).encode()
+            parts.append(bytes([len(text)]) + text)
+        else:
+            parts.append(struct.pack(">Hi", rand.randrange(2 ** 16), rand.randrange(-2 ** 31, 2 ** 31)))
+
+    return b"".join(parts)
@@ -0,0 +1,101 @@
+"""Measures how long a command line compile takes from launching Python to exiting, and checks it never imports
+tkinter
+
+Run with `python -m benchmarks.startup` from the repository root, --help lists the options"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.bench import version
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Prints the modules a command imported that the command line should not need
+CHECK_IMPORTS = """
+import runpy, sys
+sys.argv = sys.argv[1:]
+try:
+    runpy.run_path(sys.argv[0], run_name="__main__")
+finally:
+    print(",".join(sorted(name for name in sys.modules
+                          if name.split(".")[0] in ("tkinter", "UI", "multiprocessing", "concurrent"))),
+          file=sys.stderr)
+"""
+
+
+def commands(source, output):
+    """Gets each (name, command) to time, starting with Python doing nothing to compare the others against"""
+
+    return [
+        ("python", [sys.executable, "-c", "pass"]),
+        ("import cli", [sys.executable, "-c", "import cli"]),
+        ("hwc.py compile", [sys.executable, "hwc.py", source, "-o", output]),
+        ("cli.py compile", [sys.executable, "cli.py", source, "-o", output]),
+        ("main.py compile", [sys.executable, "main.py", source, "-o", output]),
+    ]
+
+
+def time_command(command, runs):
+    """Runs a command runs times, returning the best and mean seconds it took"""
+
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+
+    return min(times), sum(times) / len(times)
+
+
+def unneeded_imports(script, args):
+    """Gets the GUI and process pool modules a script imports when run with args"""
+
+    result = subprocess.run([sys.executable, "-c", CHECK_IMPORTS, script] + args, cwd=ROOT, check=True,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    lines = result.stderr.strip().splitlines()
+    return lines[-1].split(",") if lines and lines[-1] else []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the startup time of a command line compile")
+    parser.add_argument("--runs", type=int, default=20, help="times to run each command")
+    parser.add_argument("--out", default=None, help="writes a JSON report to this file")
+    args = parser.parse_args(argv)
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "small.hw")
+        output = os.path.join(directory, "small.bin")
+
+        with open(source, "w") as fp:
+            fp.write("[u8] +1 +2 #ff 'hello'\n")
+
+        baseline = None
+        for name, command in commands(source, output):
+            best, mean = time_command(command, args.runs)
+            baseline = best if baseline is None else baseline
+
+            print("%-18s %8.1fms best %8.1fms mean %+8.1fms over python" % (
+                name, best * 1000, mean * 1000, (best - baseline) * 1000))
+            results.append({"command": name, "best": best, "mean": mean})
+
+        imports = {script: unneeded_imports(script, [source, "-o", output])
+                   for script in ("hwc.py", "cli.py", "main.py")}
+
+    for script, modules in imports.items():
+        print("%s imports: %s" % (script, ", ".join(modules) if modules else "no GUI or process pool modules"))
+
+    if args.out is not None:
+        with open(args.out, "w") as fp:
+            json.dump({"version": version(), "python": sys.version.split()[0], "results": results,
+                       "imports": imports}, fp, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,36 +2,91 @@ import sys
 import os
 import json
 from compiler.compiler import Compiler, Parser
-from compiler.decompiler import Decompiler
+from compiler.cache import CompileCache
+from compiler.stats import Stats
+from compiler.batch import output_paths, compile_files, decompile_files, compile_error_message, \
+    decompile_error_message, DECOMPILE_ERRORS
+from compiler.regexparser import read_chunks
+from compiler.decompiler import Decompiler, Query, map_file
+from compiler.verify import verify, DecompileError
+from compiler.index import open_index, parse_range, iter_records
+from compiler.watch import Watcher
 
 
 def handle_argv(argv):
-    """Handles command line arguments and returns the arguments"""
-
-    files = []
-    encoding = "UTF-8"
-    dps = 4
-    output = None
-    decompile_rules = None
-
-    # Check if next argument is a value
-    output_next = False
-    encoding_next = False
-    dps_next = False
-    decompile_next = False
+    """Handles command line arguments and returns a dictionary of the options, or None if they are invalid"""
+
+    options = {
+        "files": [],
+        "output": None,
+        "encoding": "UTF-8",
+        "dps": 4,
+        "decompile": None,
+        "cache": None,
+        "out_dir": None,
+        "name": None,
+        "jobs": os.cpu_count() or 1,
+        "stats": False,
+        "stats_json": None,
+        "verify": False,
+        "record": None,
+        "range": None,
+        "where": None,
+        "watch": False,
+        "serve": None,
+    }
+
+    # The option that the next argument is the value of
+    value_next = None
 
     for arg in argv:
         if arg in ["/out", "--out", "-out", "-o", "/o"]:
-            output_next = True
+            value_next = "output"
 
         elif arg in ["/decompile", "--decompile", "-decompile", "-d", "/d"]:
-            decompile_next = True
+            value_next = "decompile"
 
         elif arg in ["/encoding", "-encoding", "--encoding", "-e", "/e"]:
-            encoding_next = True
+            value_next = "encoding"
 
         elif arg in ["/default_pad_size", "-default_pad_size", "--default_pad_size", "-dps", "/dps"]:
-            dps_next = True
+            value_next = "dps"
+
+        elif arg in ["/cache", "--cache", "-cache", "-c", "/c"]:
+            value_next = "cache"
+
+        elif arg in ["/out_dir", "--out_dir", "-out_dir", "-od", "/od"]:
+            value_next = "out_dir"
+
+        elif arg in ["/name", "--name", "-name", "-n", "/n"]:
+            value_next = "name"
+
+        elif arg in ["/jobs", "--jobs", "-jobs", "-j", "/j"]:
+            value_next = "jobs"
+
+        elif arg in ["/stats", "--stats", "-stats", "-s", "/s"]:
+            options["stats"] = True
+
+        elif arg in ["/stats_json", "--stats_json", "-stats_json", "-sj", "/sj"]:
+            value_next = "stats_json"
+
+        elif arg in ["/verify", "--verify", "-verify", "-v", "/v"]:
+            options["verify"] = True
+
+        elif arg in ["/record", "--record", "-record", "-r", "/r"]:
+            value_next = "record"
+
+        elif arg in ["/range", "--range", "-range", "-rg", "/rg"]:
+            value_next = "range"
+
+        elif arg in ["/where", "--where", "-where", "-w", "/w"]:
+            value_next = "where"
+
+        elif arg in ["/watch", "--watch", "-watch", "-wt", "/wt"]:
+            options["watch"] = True
+
+        elif arg in ["/serve", "--serve", "-serve", "-sv", "/sv"]:
+            value_next = "serve"
 
         elif arg in ["/help", "-help", "--help", "-h", "/h", "/?"]:
             print("Command line options:")
@@ -43,94 +98,494 @@ def handle_argv(argv):
             print("\t\tSpecifies the default pad size")
             print("\t/decompile --decompile -decompile -d /d")
             print("\t\tDecompiles binary back into hw script with a set of rules")
+            print("\t/cache --cache -cache -c /c")
+            print("\t\tSpecifies a directory to cache compiled files in, unchanged files are not compiled again")
+            print("\t/out_dir --out_dir -out_dir -od /od")
+            print("\t\tCompiles or decompiles each file separately into its own output in a directory")
+            print("\t/name --name -name -n /n")
+            print("\t\tSpecifies the output file name for each file when using out_dir, {stem} is the input file's name")
+            print("\t\twithout its extension, {name} is its full name and {index} its position, defaults to {stem}.bin")
+            print("\t\twhen compiling and {stem}.hw when decompiling")
+            print("\t/jobs --jobs -jobs -j /j")
+            print("\t\tSpecifies the number of processes used when using out_dir, defaults to the number of cores")
+            print("\t/stats --stats -stats -s /s")
+            print("\t\tPrints token, byte and record counts and the time spent in each phase, not used with out_dir")
+            print("\t/stats_json --stats_json -stats_json -sj /sj")
+            print("\t\tWrites the stats to a JSON file")
+            print("\t/verify --verify -verify -v /v")
+            print("\t\tChecks that decompiling each file with the decompile rules then compiling it gives back the")
+            print("\t\tsame bytes, reporting the offset and rule of the first difference")
+            print("\t/record --record -record -r /r")
+            print("\t\tDecompiles only the top level records N..M, either side can be left out, an index of where each")
+            print("\t\trecord starts is saved next to the file so later runs go straight to them")
+            print("\t/range --range -range -rg /rg")
+            print("\t\tDecompiles only the top level records holding the bytes at offsets N..M")
+            print("\t/where --where -where -w /w")
+            print("\t\tDecompiles only the records of a struct whose variables match, such as \"@module.$length>100\",")
+            print("\t\tconditions joined by commas must all match, the operators are == != < <= > >=")
+            print("\t/watch --watch -watch -wt /wt")
+            print("\t\tKeeps running, compiling the files again to the output or out_dir whenever they or a file they")
+            print("\t\tinclude change, until interrupted with Ctrl+C")
+            print("\t/serve --serve -serve -sv /sv")
+            print("\t\tRuns a compile server on a Unix socket, or on stdin and stdout if given -, answering JSON-RPC")
+            print("\t\tcompile and decompile requests one per line with jobs worker processes,")
+            print("\t\tpython -m compiler.client sends requests to it")
             print("\t/help --help -help -h /h /?")
             print("\t\tShows this dialog")
 
-
-        elif decompile_next:
-            decompile_rules = arg
-
-        elif output_next:
-            output = arg
-
-        elif encoding_next:
+        elif value_next == "encoding":
             try:
                 "".encode(arg)
-                encoding = arg
+                options["encoding"] = arg
             except:
                 print("Unknown encoding:", arg)
-                return None, None, None, None, None
+                return None
+            value_next = None
 
-        elif dps_next:
+        elif value_next == "dps":
             if arg.isdigit():
-                dps = int(arg)
+                options["dps"] = int(arg)
             else:
                 print("default pad size must be an integer")
-                return None, None, None, None, None
+                return None
+            value_next = None
+
+        elif value_next == "jobs":
+            if arg.isdigit() and int(arg) > 0:
+                options["jobs"] = int(arg)
+            else:
+                print("jobs must be a positive integer")
+                return None
+            value_next = None
+
+        elif value_next == "record" or value_next == "range":
+            try:
+                options[value_next] = parse_range(arg)
+            except ValueError:
+                print(value_next, "must be a range of positive integers such as 10..20")
+                return None
+            value_next = None
+
+        elif value_next == "where":
+            try:
+                options["where"] = Query(arg)
+            except ValueError:
+                print("Invalid where condition:", arg)
+                print("Conditions look like @struct.$var>100")
+                return None
+            value_next = None
+
+        elif value_next is not None:
+            options[value_next] = arg
+            value_next = None
 
         elif os.path.isfile(os.path.abspath(arg)):
-            files.append(arg)
+            options["files"].append(arg)
 
         else:
             print("Unknown command option:", arg)
             print("Use --help to get a list of options")
-            return None, None, None, None, None
+            return None
+
+    return options
+
+
+class ReadError(Exception):
+    """Raised by read_files when an input file fails to read or decode part way through compiling it"""
+
+    def __init__(self, file, error):
+        Exception.__init__(self, file, error)
+        self.file = file
+        self.error = error
+
+
+def read_files(files):
+    """Reads each file a chunk at a time, as if they were one string, raising ReadError if one cannot be read"""
+
+    for file in files:
+        try:
+            fp = open(file)
+        except Exception as err:
+            print("Unable to open file:", file)
+            print("Error:", err)
+            continue
+
+        with fp:
+            try:
+                yield from read_chunks(fp)
+            except (OSError, UnicodeDecodeError) as err:
+                raise ReadError(file, err) from err
+
+
+def include_dirs(files) -> list:
+    """Gets the directories of the input files, included files are looked up next to them"""
+
+    directories = []
+    for file in files:
+        directory = os.path.dirname(os.path.abspath(file))
+        if directory not in directories:
+            directories.append(directory)
+
+    return directories
+
+
+def batch_outputs(options, default_name):
+    """Gets the output path of each file from the out_dir and name options, or None if they are invalid"""
+
+    files = options["files"]
+    name = default_name if options["name"] is None else options["name"]
+
+    try:
+        outputs = output_paths(files, options["out_dir"], name)
+    except (KeyError, IndexError, ValueError) as err:
+        print("Invalid output name:", options["name"])
+        print("Error:", err)
+        return None
+
+    # Two inputs writing to the same output would overwrite each other
+    seen = {}
+    for file, output in zip(files, outputs):
+        if output in seen:
+            print("Files", seen[output], "and", file, "would both be written to", output)
+            return None
+        seen[output] = file
+
+    try:
+        os.makedirs(options["out_dir"], exist_ok=True)
+    except OSError as err:
+        print("Could not create output directory", options["out_dir"])
+        print("Error:", err)
+        return None
+
+    return outputs
+
+
+def compile_batch(options):
+    """Compiles each file to its own output file in parallel, reporting errors for each file"""
+
+    files = options["files"]
+    outputs = batch_outputs(options, "{stem}.bin")
+    if outputs is None:
+        return
+
+    results = compile_files(files, outputs, options["encoding"], options["dps"], options["cache"], options["jobs"])
+
+    failed = 0
+    for file, output, error in results:
+        if error is not None:
+            failed += 1
+            print(file + ":", error)
+
+    print("Compiled", len(files) - failed, "of", len(files), "files,", failed, "failed")
+
+
+def decompile_batch(options, rules):
+    """Decompiles each file to its own hw script in parallel, reporting errors for each file"""
+
+    files = options["files"]
+    outputs = batch_outputs(options, "{stem}.hw")
+    if outputs is None:
+        return
+
+    results = decompile_files(files, outputs, rules, options["encoding"], options["dps"], options["jobs"])
+
+    failed = 0
+    total_read = 0
+    total_leftover = 0
+
+    try:
+        for file, output, error, read, leftover in results:
+            if error is not None:
+                failed += 1
+                print(file + ":", error)
+
+            total_read += read
+            total_leftover += leftover
+
+    # The rules are compiled before any file is decompiled
+    except DECOMPILE_ERRORS as err:
+        print(decompile_error_message(err))
+        return
+
+    print("Decompiled", len(files) - failed, "of", len(files), "files,", failed, "failed")
+    print("Read", total_read, "bytes,", total_leftover, "bytes left over")
+
+
+def verify_files(options, rules):
+    """Checks each file round trips through the decompiler and compiler, reporting where the first ones differ"""
+
+    for file in options["files"]:
+        try:
+            with open(file, "rb") as fp:
+                binary = map_file(fp)
+        except OSError:
+            print("Cannot open file:", file)
+            continue
+
+        try:
+            mismatch = verify(rules, binary, options["encoding"], options["dps"])
+        except DecompileError as err:
+            print(file + ":", decompile_error_message(err.error))
+            continue
+        except Exception as err:
+            print(file + ":", "Decompiled output does not compile:", compile_error_message(err))
+            continue
+
+        if mismatch is None:
+            print(file + ":", "OK,", len(binary), "bytes round trip")
+        else:
+            print(file + ":", mismatch)
+
+
+def decompile_records(hw, options, rules):
+    """Decompiles only the records picked by the record or range option of each file, using its record index"""
+
+    for file in options["files"]:
+        try:
+            with open(file, "rb") as fp:
+                binary = map_file(fp)
+        except OSError:
+            print("Cannot open file:", file)
+            continue
+
+        try:
+            index = open_index(hw, rules, file, binary)
+
+            if options["record"] is not None:
+                start, stop = options["record"]
+            else:
+                start, stop = index.overlapping(*options["range"])
+                if start == stop:
+                    first, last = options["range"]
+                    print(file + ":", "no record covers bytes %d..%s" % (first, "" if last is None else last - 1))
+                    continue
+
+            if start >= len(index):
+                print(file + ":", "has", len(index), "records")
+                continue
+
+            sys.stdout.writelines(iter_records(hw, rules, binary, index, start, stop))
+            print()
+
+        except BrokenPipeError:
+            # The reader stopped early (e.g. head), send anything still buffered to devnull
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            return
+        except DECOMPILE_ERRORS as err:
+            print(decompile_error_message(err))
+
+
+def filter_records(hw, options, rules):
+    """Decompiles only the records of each file that match the where option"""
+
+    for file in options["files"]:
+        try:
+            with open(file, "rb") as fp:
+                binary = map_file(fp)
+        except OSError:
+            print("Cannot open file:", file)
+            continue
+
+        try:
+            matched = hw.decompile_where(rules, binary, options["where"], sys.stdout)
+            print()
+            print("/*", matched, "records matched */")
+
+        except BrokenPipeError:
+            # The reader stopped early (e.g. head), send anything still buffered to devnull
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            return
+        except DECOMPILE_ERRORS as err:
+            print(decompile_error_message(err))
+
+
+def watch_files(options):
+    """Compiles the files whenever they change, to the output file or each to its own file in out_dir"""
+
+    if options["out_dir"] is not None:
+        outputs = batch_outputs(options, "{stem}.bin")
+        if outputs is None:
+            return
+        targets = [([file], output) for file, output in zip(options["files"], outputs)]
+
+    elif options["output"] is not None:
+        targets = [(options["files"], options["output"])]
+
+    else:
+        print("watch needs an output file or out_dir to write to")
+        return
+
+    try:
+        hw = Compiler(options["encoding"], options["dps"], CompileCache(options["cache"]),
+                      include_dirs(options["files"]))
+    except OSError as err:
+        print("Could not create cache directory", options["cache"])
+        print("Error:", err)
+        return
+
+    print("Watching", len(options["files"]), "files, press Ctrl+C to stop")
+    Watcher(hw, targets).run()
+
 
-    return files, output, encoding, dps, decompile_rules
+def serve(options):
+    """Runs a compile server until interrupted or, on stdio, until stdin ends"""
+
+    # Only imported when serving, as it imports socketserver and concurrent.futures that other commands never need
+    from compiler.server import Server
+
+    server = Server(options["jobs"], options["cache"])
+
+    try:
+        if options["serve"] == "-":
+            server.serve_stream(sys.stdin.buffer, sys.stdout.buffer)
+        else:
+            print("Listening on", options["serve"], "with", options["jobs"], "jobs, press Ctrl+C to stop")
+            server.serve_socket(options["serve"])
+
+    except OSError as err:
+        print("Could not start server:", err)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+def report_stats(stats, options):
+    """Prints the stats and writes them to a JSON file if the options ask for it"""
+
+    if options["stats"]:
+        # Printed to stderr so the stats do not mix with compiled or decompiled output
+        print(stats.summary(), file=sys.stderr)
+
+    if options["stats_json"] is not None:
+        try:
+            with open(options["stats_json"], "w") as fp:
+                json.dump(stats.to_dict(), fp, indent=4)
+        except OSError as err:
+            print("Could not write to file", options["stats_json"])
+            print("Error:", err)
 
 
 def command_line_interface():
     """Takes the command line parameter and executes them"""
 
-    files, output, encoding, dps, decompile_rules = handle_argv(sys.argv[1:])
-    if files is None:
+    options = handle_argv(sys.argv[1:])
+    if options is None:
+        return
+
+    files = options["files"]
+    output = options["output"]
+    encoding = options["encoding"]
+    dps = options["dps"]
+    decompile_rules = options["decompile"]
+    cache = options["cache"]
+    stats = Stats() if options["stats"] or options["stats_json"] is not None else None
+
+    if options["serve"] is not None:
+        serve(options)
         return
 
     if len(files) == 0:
         handle_argv(["-help"])
         return
 
+    if stats is not None and options["out_dir"] is not None:
+        print("Stats are not collected when using out_dir")
+
+    if options["verify"] and decompile_rules is None:
+        print("verify needs the rules to decompile with, given with --decompile")
+        return
+
+    if options["watch"] and decompile_rules is None:
+        watch_files(options)
+
+    # Check if we are compiling each file separately
+    elif decompile_rules is None and options["out_dir"] is not None:
+        compile_batch(options)
+
     # Check if we are decompiling
-    if decompile_rules is None:
+    elif decompile_rules is None:
         # We are compiling
 
-        hw = Compiler(encoding, dps)
+        # A single file is where relative includes are found from
+        path = os.path.abspath(files[0]) if len(files) == 1 else None
 
-        string = ""
+        if cache is None:
+            hw = Compiler(encoding, dps, include_dirs=include_dirs(files), stats=stats)
 
-        for file in files:
+            # The files are read a chunk at a time while compiling
+            string = read_files(files)
+        else:
             try:
-                with open(file) as fp:
-                    string += fp.read()
-            except Exception as err:
-                print("Unable to open file:", file)
+                hw = Compiler(encoding, dps, CompileCache(cache), include_dirs(files), stats)
+            except OSError as err:
+                print("Could not create cache directory", cache)
                 print("Error:", err)
+                return
+
+            string = read_files(files)
 
         try:
-            byte_array = hw.compile(string)
+            if cache is not None and path is not None:
+                # A single file is built like an included file, so only the files that changed are compiled
+                byte_array = hw.compile_file(path)
+                string = None
+            else:
+                byte_array = None
+
+                if cache is not None:
+                    # The whole source is needed to look it up in the cache
+                    string = "".join(string)
 
             if output is None:
+                if byte_array is None:
+                    byte_array = hw.compile(string, path)
                 print(str(byte_array)[2:-1])
             else:
                 try:
-                    with open(output, "wb") as fp:
-                        fp.write(byte_array)
+                    fp = open(output, "wb")
                 except Exception as err:
                     print("Could not write to file", output)
                     print("Error:", err)
+                    return
 
+                # Write each token as it is compiled, removing the partial file if compiling fails
+                try:
+                    with fp:
+                        if byte_array is None:
+                            hw.compile_to(string, fp, path)
+                        else:
+                            fp.write(byte_array)
+                except BaseException:
+                    os.remove(output)
+                    raise
+
+        # Reading and decoding the inputs happens while compiling, so their errors are told apart from the output's
+        except ReadError as err:
+            print("Unable to open file:", err.file)
+            print("Error:", err.error)
+        except OSError as err:
+            print("Could not write to file", output)
+            print("Error:", err)
         except Parser.Error as err:
             print("Unexpected", repr(err.match.string), "on line", err.match.line)
+        except Compiler.CompileError as err:
+            print(err)
         except TypeError as err:
             print("Unexpected group type:", err)
         except ValueError as err:
+            if len(err.args) != 2:
+                raise
             err = err.args
             print("Unknown padding type:", repr(err[0]), "on line", err[1])
 
+        if stats is not None:
+            report_stats(stats, options)
+
     else:
         # we are decompiling
 
-        hw = Decompiler(encoding, dps)
+        hw = Decompiler(encoding, dps, stats)
 
         try:
             rules = json.load(open(decompile_rules))
@@ -139,29 +594,54 @@ def command_line_interface():
             print(err)
             return
 
+        if options["verify"]:
+            verify_files(options, rules)
+            return
+
+        if options["where"] is not None:
+            print(hw.get_header(rules))
+            filter_records(hw, options, rules)
+            return
+
+        if options["record"] is not None or options["range"] is not None:
+            print(hw.get_header(rules))
+            decompile_records(hw, options, rules)
+            return
+
+        # Check if we are decompiling each file separately
+        if options["out_dir"] is not None:
+            decompile_batch(options, rules)
+            return
+
         print(hw.get_header(rules))
 
         for file in files:
             try:
                 with open(file, "rb") as fp:
-                    binary = fp.read()
+                    binary = map_file(fp)
             except:
                 print("Cannot open file:", file)
                 continue
 
             try:
-                string, index = hw.decompile(rules, binary)
+                index = hw.decompile_to(rules, binary, sys.stdout)
 
                 # append the left over bytes
                 if index != len(binary):
-                    string += "\n" + (" ".join("#" + hex(byte)[2:] for byte in binary[index:]))
+                    sys.stdout.write("\n")
+                    sys.stdout.writelines(hw.iter_leftover(binary, index))
+
+                print()
 
-                print(string)
+            except BrokenPipeError:
+                # The reader stopped early (e.g. head), send anything still buffered to devnull
+                os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+                return
+            except DECOMPILE_ERRORS as err:
+                print(decompile_error_message(err))
 
-            except NameError as err:
-                print("Cannot find varname:", err)
-            except TypeError as err:
-                print("Cannot find width:", err)
+        if stats is not None:
+            report_stats(stats, options)
 
 
 if __name__ == "__main__":
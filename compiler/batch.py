@@ -0,0 +1,219 @@
+import os
+import struct
+
+from compiler.compiler import Compiler, Parser
+from compiler.cache import CompileCache
+from compiler.decompiler import Decompiler, map_file
+from compiler.regexparser import read_chunks
+
+# The compiler and decompiler used by the jobs of this process, set up once per worker by init_compiler and
+# init_decompiler
+job_compiler = None
+job_decompiler = None
+
+# The errors decompiling raises when the rules do not fit the binary data, described by decompile_error_message
+DECOMPILE_ERRORS = (NameError, TypeError, KeyError, struct.error, UnicodeDecodeError)
+
+
+def output_paths(files, out_dir, name=None) -> list:
+    """Gets the output path of each file in out_dir from a name template, {stem} is the file name without its
+    extension, {name} is the full file name and {index} is the file's position"""
+
+    if name is None:
+        name = "{stem}.bin"
+
+    paths = []
+    for index, file in enumerate(files):
+        base = os.path.basename(file)
+        stem = os.path.splitext(base)[0]
+        paths.append(os.path.join(out_dir, name.format(stem=stem, name=base, index=index)))
+
+    return paths
+
+
+def run_jobs(function, tasks, jobs, initializer, initargs):
+    """Runs function over each task using a pool of jobs processes each set up by initializer, yielding the results
+    in the order of the tasks"""
+
+    tasks = list(tasks)
+
+    # A pool is not worth starting for a single process
+    if jobs == 1 or len(tasks) <= 1:
+        initializer(*initargs)
+        yield from map(function, tasks)
+        return
+
+    # Only imported when needed, as it takes longer to import than most single file commands take to run
+    from concurrent.futures import ProcessPoolExecutor
+
+    jobs = min(jobs, len(tasks))
+    with ProcessPoolExecutor(jobs, initializer=initializer, initargs=initargs) as executor:
+        # Send tasks in chunks so many small files do not cost a round trip each
+        yield from executor.map(function, tasks, chunksize=max(1, len(tasks) // (jobs * 4)))
+
+
+def init_compiler(text_encode, pad_size, cache_dir):
+    """Creates the compiler used by the compile jobs of this process"""
+
+    global job_compiler
+    job_compiler = Compiler(text_encode, pad_size, None if cache_dir is None else CompileCache(cache_dir))
+
+
+def compile_job(task):
+    """Compiles a (file, output) task with this process's compiler, returning an error message or None"""
+
+    return compile_file(job_compiler, *task)
+
+
+def compile_file(hw, file, output):
+    """Compiles a file to its own output file, returning an error message or None, the output is removed if it
+    fails to compile"""
+
+    try:
+        fp = open(file)
+    except OSError as err:
+        return "Unable to open file: %s" % err
+
+    with fp:
+        # With a cache the file is built like an included file so only the files that changed are compiled,
+        # otherwise it is read a chunk at a time
+        string = read_chunks(fp) if hw.cache is None else None
+
+        try:
+            out = open(output, "wb")
+        except OSError as err:
+            return "Could not write to file %s: %s" % (output, err)
+
+        try:
+            with out:
+                if string is None:
+                    out.write(hw.compile_file(file))
+                else:
+                    hw.compile_to(string, out, os.path.abspath(file))
+            return None
+
+        # Any error only fails this file, the rest of the batch still compiles
+        except Exception as err:
+            os.remove(output)
+            return compile_error_message(err)
+
+        except BaseException:
+            os.remove(output)
+            raise
+
+
+def compile_error_message(err) -> str:
+    """Describes an error raised while compiling"""
+
+    if isinstance(err, Parser.Error):
+        return "Unexpected %r on line %d" % (err.match.string, err.match.line)
+    elif isinstance(err, Compiler.CompileError):
+        return str(err)
+    elif isinstance(err, TypeError):
+        return "Unexpected group type: %s" % err
+    elif isinstance(err, ValueError) and len(err.args) == 2:
+        return "Unknown padding type: %r on line %s" % err.args
+    elif isinstance(err, KeyError):
+        return "Unknown name: %s" % err
+    return "Error: %s" % err
+
+
+def compile_files(files, outputs, text_encode="UTF-8", pad_size=4, cache_dir=None, jobs=None):
+    """Compiles each file to its output in parallel, yielding (file, output, error message or None) as each
+    finishes in order"""
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    tasks = list(zip(files, outputs))
+    results = run_jobs(compile_job, tasks, jobs, init_compiler, (text_encode, pad_size, cache_dir))
+
+    for (file, output), error in zip(tasks, results):
+        yield file, output, error
+
+
+def init_decompiler(text_encode, pad_size, plan, header):
+    """Sets up the decompiler used by the decompile jobs of this process with a plan compiled by the parent"""
+
+    global job_decompiler
+    job_decompiler = (Decompiler(text_encode, pad_size), plan, header)
+
+
+def decompile_job(task):
+    """Decompiles a (file, output) task with this process's decompiler, returning (error message or None, bytes
+    read, bytes left over)"""
+
+    return decompile_file(*job_decompiler, *task)
+
+
+def decompile_file(hw, plan, header, file, output):
+    """Decompiles a binary file to its own hw script starting with the header, returning (error message or None,
+    bytes read, bytes left over), the output is removed if it fails to decompile"""
+
+    try:
+        with open(file, "rb") as fp:
+            binary = map_file(fp)
+    except OSError as err:
+        return "Cannot open file: %s" % err, 0, 0
+
+    try:
+        out = open(output, "w")
+    except OSError as err:
+        return "Could not write to file %s: %s" % (output, err), 0, 0
+
+    try:
+        with out:
+            out.write(header + "\n")
+            index = hw.write_plan(plan, memoryview(binary), 0, out)
+
+            # append the left over bytes
+            if index != len(binary):
+                out.write("\n")
+                out.writelines(hw.iter_leftover(binary, index))
+
+            out.write("\n")
+        return None, index, max(len(binary) - index, 0)
+
+    # Any error only fails this file, the rest of the batch still decompiles
+    except Exception as err:
+        os.remove(output)
+        return decompile_error_message(err), 0, 0
+
+    except BaseException:
+        os.remove(output)
+        raise
+
+
+def decompile_error_message(err) -> str:
+    """Describes an error raised while decompiling"""
+
+    if isinstance(err, NameError):
+        return "Cannot find varname: %s" % err
+    elif isinstance(err, TypeError):
+        return "Cannot find width: %s" % err
+    elif isinstance(err, KeyError):
+        return "No struct for switch value: %s" % err
+    elif isinstance(err, struct.error):
+        return "Cannot decode value: %s" % err
+    elif isinstance(err, UnicodeDecodeError):
+        return "Cannot decode text: %s" % err
+    return "Error: %s" % err
+
+
+def decompile_files(files, outputs, rules, text_encode="UTF-8", pad_size=4, jobs=None):
+    """Decompiles each binary file to its own hw script in parallel, yielding (file, output, error message or None,
+    bytes read, bytes left over) as each finishes in order, the rules are compiled once and shared with every
+    worker"""
+
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+
+    hw = Decompiler(text_encode, pad_size)
+    plan = hw.plan(rules)
+    header = hw.get_header(rules)
+
+    tasks = list(zip(files, outputs))
+    results = run_jobs(decompile_job, tasks, jobs, init_decompiler, (text_encode, pad_size, plan, header))
+
+    for (file, output), result in zip(tasks, results):
+        yield (file, output) + result
@@ -0,0 +1,138 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+
+class CompileCache:
+    # Bump when the compiler changes what a source compiles to, so old entries are never reused
+    version = 2
+
+    def __init__(self, directory=None, max_entries=256, max_disk_size=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_disk_size = max_disk_size
+
+        self.entries = OrderedDict()
+        self.disk_size = None
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, text, text_encode, pad_size) -> str:
+        """Hashes a source string together with the options that change how it compiles"""
+
+        digest = hashlib.sha256()
+        digest.update(repr((self.version, text_encode, pad_size)).encode())
+        digest.update(b"\0")
+        digest.update(text.encode("UTF-8", "surrogatepass"))
+        return digest.hexdigest()
+
+    def path(self, key) -> str:
+        """Gets the file a key is stored in on disk"""
+
+        return os.path.join(self.directory, key[:2], key[2:] + ".bin")
+
+    def get(self, key, persist=True):
+        """Gets the binary data stored for a key, or None if it is not cached, persist also checks the disk"""
+
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        if not persist or self.directory is None:
+            return None
+
+        path = self.path(key)
+        try:
+            with open(path, "rb") as fp:
+                byte_array = fp.read()
+            # Mark as recently used, eviction removes the oldest files first
+            os.utime(path)
+        except OSError:
+            return None
+
+        self.remember(key, byte_array)
+        return byte_array
+
+    def put(self, key, byte_array, persist=True):
+        """Stores the binary data for a key, persist also writes it to the disk"""
+
+        self.remember(key, byte_array)
+
+        if not persist or self.directory is None:
+            return
+
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first so other processes never read a partial entry
+        temp_path = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            with open(temp_path, "wb") as fp:
+                fp.write(byte_array)
+            os.replace(temp_path, path)
+        except OSError:
+            # The cache is only an optimisation, failing to write it is not an error
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+
+        if self.disk_size is None:
+            self.disk_size = sum(size for _, size, _ in self.iter_files())
+        else:
+            self.disk_size += len(byte_array)
+
+        if self.disk_size > self.max_disk_size:
+            self.evict()
+
+    def remember(self, key, byte_array):
+        """Stores the binary data for a key in memory, dropping the least recently used entries"""
+
+        self.entries[key] = byte_array
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def iter_files(self):
+        """Yields the path, size and last use time of every entry on disk"""
+
+        for folder in os.scandir(self.directory):
+            if not folder.is_dir():
+                continue
+
+            for entry in os.scandir(folder.path):
+                if entry.name.endswith(".bin"):
+                    stat = entry.stat()
+                    yield entry.path, stat.st_size, stat.st_mtime
+
+    def evict(self):
+        """Removes the least recently used entries on disk until it is back under three quarters of its size limit"""
+
+        files = sorted(self.iter_files(), key=lambda file: file[2])
+        self.disk_size = sum(size for _, size, _ in files)
+
+        for path, size, _ in files:
+            if self.disk_size <= self.max_disk_size * 3 // 4:
+                break
+
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.disk_size -= size
+
+    def clear(self):
+        """Removes every entry from memory and the disk"""
+
+        self.entries.clear()
+
+        if self.directory is not None:
+            for path, _, _ in list(self.iter_files()):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self.disk_size = 0
@@ -0,0 +1,128 @@
+"""A thin client for the compile server, it imports nothing from the compiler so it starts quickly
+
+Run with `python -m compiler.client SOCKET compile FILE... -o OUTPUT` or
+`python -m compiler.client SOCKET decompile FILE -d RULES -o OUTPUT` from the repository root"""
+
+import argparse
+import base64
+import json
+import os
+import socket
+import sys
+
+
+class Client:
+    """Sends JSON-RPC requests to a compile server over its Unix socket"""
+
+    class Error(Exception):
+        def __init__(self, code, message):
+            Exception.__init__(self, message)
+            self.code = code
+
+    def __init__(self, path):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(path)
+        self.file = self.socket.makefile("rwb")
+        self.next_id = 0
+
+    def request(self, method, **params):
+        """Sends a request and waits for its result, raising Client.Error if the server answers with an error"""
+
+        self.next_id += 1
+        self.file.write(json.dumps({"jsonrpc": "2.0", "id": self.next_id, "method": method, "params": params})
+                        .encode() + b"\n")
+        self.file.flush()
+
+        line = self.file.readline()
+        if not line:
+            raise Client.Error(0, "The server closed the connection")
+
+        response = json.loads(line)
+        if "error" in response:
+            raise Client.Error(response["error"]["code"], response["error"]["message"])
+
+        return response["result"]
+
+    def compile(self, path, output=None, **options):
+        """Compiles a file on the server, writing it to output or returning its bytes"""
+
+        params = dict(options, path=os.path.abspath(path))
+        if output is not None:
+            params["output"] = os.path.abspath(output)
+
+        result = self.request("compile", **params)
+        return None if output is not None else base64.b64decode(result["data"])
+
+    def decompile(self, path, rules_path, output=None, **options):
+        """Decompiles a binary file on the server with a rules file, writing it to output or returning the text"""
+
+        params = dict(options, path=os.path.abspath(path), rules_path=os.path.abspath(rules_path))
+        if output is not None:
+            params["output"] = os.path.abspath(output)
+
+        result = self.request("decompile", **params)
+        return None if output is not None else result["text"]
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sends compile and decompile requests to a compile server")
+    parser.add_argument("socket", help="the Unix socket the server listens on")
+    parser.add_argument("command", choices=["compile", "decompile", "ping"])
+    parser.add_argument("files", nargs="*")
+    parser.add_argument("-o", "--out", default=None, help="the output file, printed if not given")
+    parser.add_argument("-d", "--decompile", default=None, help="the rules to decompile with")
+    parser.add_argument("-e", "--encoding", default="UTF-8", help="the encoding of string literals")
+    parser.add_argument("-dps", "--default_pad_size", type=int, default=4, help="the default pad size")
+    args = parser.parse_args(argv)
+
+    options = {"encoding": args.encoding, "pad_size": args.default_pad_size}
+
+    try:
+        client = Client(args.socket)
+    except OSError as err:
+        print("Cannot connect to server:", err)
+        return 1
+
+    try:
+        if args.command == "ping":
+            print(client.request("ping"))
+
+        elif args.command == "compile":
+            if args.out is not None and len(args.files) == 1:
+                # The server writes the output itself, so the bytes are never sent back
+                client.compile(args.files[0], args.out, **options)
+                return 0
+
+            # Several files are compiled one after another into the same output, as cli.py does
+            byte_arrays = [client.compile(file, **options) for file in args.files]
+
+            if args.out is None:
+                print(str(b"".join(byte_arrays))[2:-1])
+            else:
+                with open(args.out, "wb") as fp:
+                    fp.writelines(byte_arrays)
+
+        else:
+            if args.decompile is None or len(args.files) != 1:
+                print("decompile needs one file and its rules given with -d")
+                return 1
+
+            text = client.decompile(args.files[0], args.decompile, args.out, **options)
+            if text is not None:
+                sys.stdout.write(text)
+
+    except Client.Error as err:
+        print(err)
+        return 1
+    finally:
+        client.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,33 +1,198 @@
 import ast
+import hashlib
+import io
+import itertools
+import json
+import os
+import re
+import time
 
-from compiler.regexparser import Parser
+from compiler.regexparser import Parser, LineIndex
 import struct
 import compiler.consts as consts
 
 
 class Compiler(Parser):
-    def __init__(self, text_encode="UTF-8", pad_size=4):
-        Parser.__init__(self, consts.REGEX)
+    class CompileError(Exception):
+        def __init__(self, message, line):
+            self.message = message
+            self.line = line
+            Exception.__init__(self, "%s on line %s" % (message, line))
+
+    class IncludeError(CompileError):
+        def __init__(self, message, line, path):
+            self.message = message
+            self.line = line
+            self.path = path
+            Exception.__init__(self, ("%s in %s" if line is None else "%s on line %s of %s") % (
+                (message, path) if line is None else (message, line, path)))
+
+    def __init__(self, text_encode="UTF-8", pad_size=4, cache=None, include_dirs=None, stats=None):
+        Parser.__init__(self, consts.REGEX, partial=consts.PARTIAL_REGEX, stats=stats)
+
+        # The parser of array elements and the regexes matching arrays of one type, created by the first array
+        self.array_parser = None
+        self.array_types = None
 
         self.pad_defs = consts.PAD_DEFS
         self.pad_size = pad_size
         self.text_encode = text_encode
 
-    def compile(self, text: str) -> bytes:
-        """Takes in a string and compiles it to binary data"""
+        # A CompileCache that string sources, definitions and included files are looked up in before being compiled
+        self.cache = cache
+
+        # Directories searched for included files after the directory of the file including them
+        self.include_dirs = [] if include_dirs is None else include_dirs
+
+        # The Fragment of every included file by its absolute path, kept to rebuild only the files that changed
+        self.fragments = {}
+
+    def compile(self, text, path=None) -> bytes:
+        """Takes in a string, or an iterable of string chunks, and compiles it to binary data, path is the file the
+        text came from if any"""
+
+        if self.cacheable(text):
+            return self.compile_cached(text)
+
+        stream = io.BytesIO()
+        self.encode_to(text, stream, path)
+        return stream.getvalue()
+
+    def compile_to(self, text, stream, path=None) -> int:
+        """Takes in a string, or an iterable of string chunks such as read_chunks(fp), and writes the binary data of
+        each token straight to a binary stream, returning the number of bytes written, path is the file the text
+        came from if any"""
+
+        if self.cacheable(text):
+            byte_array = self.compile_cached(text)
+            stream.write(byte_array)
+            return len(byte_array)
+
+        return self.encode_to(text, stream, path)
+
+    def compile_file(self, path) -> bytes:
+        """Compiles a file, only compiling the files it includes again if they changed since they were last built"""
+
+        return self.build(os.path.abspath(path)).byte_array
+
+    def cacheable(self, text) -> bool:
+        """Checks if the result of compiling text only depends on the text, text that includes other files is
+        instead cached a file at a time"""
+
+        return self.cache is not None and type(text) == str and ".include" not in text.lower()
+
+    def compile_cached(self, text, persist=True) -> bytes:
+        """Compiles a string through the cache, only compiling it if it has not been seen before, persist=False keeps
+        the result out of the cache directory"""
 
-        tokens = self.scan(text, remove=["white_space", "comment"])
+        key = self.cache.key(text, self.text_encode, self.pad_size)
+        byte_array = self.cache.get(key, persist)
+
+        if byte_array is None:
+            stream = io.BytesIO()
+            self.encode_to(text, stream)
+            byte_array = stream.getvalue()
+            self.cache.put(key, byte_array, persist)
+
+        return byte_array
+
+    def encode_to(self, text, stream, path=None, fragment=None, stack=()) -> int:
+        """Compiles text to a binary stream without using the cache, returning the number of bytes written
+
+        path is the file the text came from, used to find the files it includes, fragment is the Fragment that
+        the text's includes and definitions are exported to and stack is the paths of the files including it, None
+        for text with no file"""
+
+        tokens = self.iter_scan([text] if type(text) == str else text, remove=["white_space", "comment"])
 
         defs = {}
         pad_size = self.pad_size
         pad_defs = self.pad_defs.copy()
 
-        byte_array = bytes()
-        
+        write = stream.write
+        written = 0
+
+        stats = self.stats
+        if stats is not None:
+            tokens = stats.timed("tokenize", tokens)
+            write = stats.timed_call("write", write)
+
+            # Time spent in the other phases, including nested compiles, is not encode time
+            start = time.perf_counter()
+            other_phases = stats.times["tokenize"] + stats.times["write"] + stats.times["encode"]
+
+        # The (count, start token, block, write, written) of each open .repeat, the bytes of a block are encoded once
+        # into their own stream then written count times
+        blocks = []
+        block = None
+
+        # The number of bytes the next value fills and the .fill token that set it
+        fill = None
+        fill_token = None
+
         for token in tokens:
-            if token.group == "def":
+            if token.group == "directive":
+                name, count = self.read_directive(token, pad_defs)
+
+                if fill is not None:
+                    raise Compiler.CompileError("Expected a value after .fill", fill_token.line)
+
+                if name == "include":
+                    include = self.include(count, path, stack, token)
+
+                    if fragment is not None:
+                        fragment.includes.append((include.path, include.key))
+
+                    # The definitions of an included file are visible after it
+                    defs.update(include.defs)
+                    pad_defs.update(include.pad_defs)
+                    byte_array = include.byte_array
+
+                elif name == "repeat":
+                    blocks.append((count, token, block, write, written))
+                    block = io.BytesIO()
+                    write = block.write
+                    written = 0
+                    continue
+
+                elif name == "end":
+                    if not blocks:
+                        raise Compiler.CompileError("Unexpected .end", token.line)
+
+                    byte_array = block.getvalue()
+                    count, _, block, write, written = blocks.pop()
+
+                    # The bytes of a block were counted as they were encoded, so the copies are not counted again
+                    written += self.write_repeated(write, byte_array, count)
+                    continue
+
+                elif name == "fill":
+                    fill = count
+                    fill_token = token
+                    continue
+
+                elif name == "align":
+                    # An included file is compiled once and kept, before where it is placed in the output is known
+                    if stack:
+                        raise Compiler.CompileError("Cannot use .align in an included file", token.line)
+
+                    # Blocks are aligned relative to their own start as they are only encoded once
+                    byte_array = bytes(-written % count)
+
+            elif token.group == "def":
                 eq_at = token.string.find("=")
-                defs[token.string[1:eq_at]] = self.compile(token.string[eq_at+1:])
+                value = token.string[eq_at+1:]
+
+                if self.cacheable(value):
+                    # Definitions are small and repeat across files, so only keep them in memory
+                    defs[token.string[1:eq_at]] = self.compile_cached(value, persist=False)
+                else:
+                    # A definition that includes a file finds it from this file, and the file becomes one of this
+                    # file's includes so it is rebuilt when the included file changes
+                    def_stream = io.BytesIO()
+                    self.encode_to(value, def_stream, path, fragment, stack)
+                    defs[token.string[1:eq_at]] = def_stream.getvalue()
+                continue
             
             elif token.group == "pad":
                 pad_type = token.string[1:-1].lower()
@@ -38,32 +203,354 @@ class Compiler(Parser):
                     raise ValueError(pad_type, token.line)
                 else:
                     pad_size = pad_defs[pad_type]
+                continue
             
             elif token.group == "sizedef":
                 eq_at = token.string.find("=")
                 pad_defs[token.string[1:eq_at]] = int(token.string[eq_at+1:])
+                continue
             
             elif token.group == "int":
                 num = int(token.string)
-                byte_array += num.to_bytes(((num.bit_length() + 7) // 8) if pad_size is None else pad_size, "big", signed=True)
+                byte_array = num.to_bytes(((num.bit_length() + 7) // 8) if pad_size is None else pad_size, "big", signed=True)
             
             elif token.group == "hex":
                 num = int(token.string[1:], 16)
-                byte_array += num.to_bytes(((num.bit_length() + 7) // 8) if pad_size is None else pad_size, "big", signed=True)
+                byte_array = num.to_bytes(((num.bit_length() + 7) // 8) if pad_size is None else pad_size, "big", signed=False)
             
             elif token.group == "bin":
                 num = int(token.string.replace(" ", "").replace("_", ""), 2)
-                byte_array += num.to_bytes(((num.bit_length() + 7) // 8) if pad_size is None else pad_size, "big", signed=True)
+                byte_array = num.to_bytes(((num.bit_length() + 7) // 8) if pad_size is None else pad_size, "big", signed=False)
             
             elif token.group == "float":
-                byte_array += struct.pack(">" + ("d" if pad_size is None or pad_size > 4 else "f"), float(token.string))
+                byte_array = struct.pack(">" + ("d" if pad_size is None or pad_size > 4 else "f"), float(token.string))
+
+            elif token.group == "array":
+                byte_array = self.encode_array(token, pad_size)
 
             elif token.group == "var":
-                byte_array += defs[token.string]
+                byte_array = defs[token.string]
 
             elif token.group == "str":
-                byte_array += ast.literal_eval(token.string).encode(self.text_encode)
+                byte_array = ast.literal_eval(token.string).encode(self.text_encode)
 
             else:
                 raise TypeError(token.group)
-        return byte_array
+
+            if fill is not None:
+                if len(byte_array) == 0:
+                    raise Compiler.CompileError("Cannot fill with an empty value", token.line)
+
+                filled = self.write_repeated(write, byte_array, fill // len(byte_array))
+                written += filled
+                byte_array = byte_array[:fill % len(byte_array)]
+                fill = None
+
+                if stats is not None:
+                    stats.emitted[token.group] += filled
+
+            write(byte_array)
+            written += len(byte_array)
+
+            if stats is not None:
+                stats.emitted[token.group] += len(byte_array)
+
+        if fill is not None:
+            raise Compiler.CompileError("Expected a value after .fill", fill_token.line)
+        if blocks:
+            raise Compiler.CompileError("Expected .end for .repeat", blocks[-1][1].line)
+
+        if fragment is not None:
+            fragment.defs = defs
+            fragment.pad_defs = {name: size for name, size in pad_defs.items()
+                                 if name not in self.pad_defs or self.pad_defs[name] != size}
+
+        if stats is not None:
+            stats.times["encode"] += time.perf_counter() - start - (
+                    stats.times["tokenize"] + stats.times["write"] + stats.times["encode"] - other_phases)
+
+        return written
+
+    def read_directive(self, token, pad_defs):
+        """Gets the name and argument of a directive token, the argument is a number or the name of a size, or a
+        quoted path"""
+
+        name, arg = (token.string[1:].split(None, 1) + [""])[:2]
+        name = name.lower()
+
+        if name not in consts.DIRECTIVES:
+            raise Compiler.CompileError("Unknown directive: ." + name, token.line)
+
+        if consts.DIRECTIVES[name] is None:
+            if arg:
+                raise Compiler.CompileError("Unexpected argument for ." + name, token.line)
+            return name, None
+
+        if consts.DIRECTIVES[name] == "path":
+            if len(arg) < 2 or arg[0] not in "'\"" or arg[-1] != arg[0]:
+                raise Compiler.CompileError("Expected a quoted path for ." + name, token.line)
+            return name, arg[1:-1]
+
+        if arg.isdigit():
+            count = int(arg)
+        elif arg.lower() in pad_defs and pad_defs[arg.lower()] is not None:
+            count = pad_defs[arg.lower()]
+        elif arg:
+            raise Compiler.CompileError("Unknown size: " + arg, token.line)
+        else:
+            raise Compiler.CompileError("Expected a size for ." + name, token.line)
+
+        if name == "align" and count == 0:
+            raise Compiler.CompileError("Cannot align to 0 bytes", token.line)
+
+        return name, count
+
+    def include(self, name, path, stack, token):
+        """Finds and builds a file included by the file at path, or by text with no file if path is None"""
+
+        # Relative paths are looked up from the including file's directory first, then the include directories
+        dirs = ([] if path is None else [os.path.dirname(path)]) + list(self.include_dirs) + [os.getcwd()]
+
+        for directory in dirs:
+            include_path = os.path.abspath(os.path.join(directory, name))
+            if os.path.isfile(include_path):
+                break
+        else:
+            if path is None:
+                raise Compiler.CompileError("Cannot find include: " + name, token.line)
+            raise Compiler.IncludeError("Cannot find include: " + name, token.line, path)
+
+        stack = stack + (path,)
+
+        if include_path in stack:
+            cycle = stack[stack.index(include_path):] + (include_path,)
+            raise Compiler.IncludeError("Include cycle: " + " -> ".join(cycle), token.line, path)
+
+        return self.build(include_path, stack)
+
+    def build(self, path, stack=()):
+        """Gets the Fragment of a file from its absolute path, only compiling it if its text or a file it includes
+        changed since it was last built"""
+
+        try:
+            stat = os.stat(path)
+        except OSError as err:
+            raise Compiler.IncludeError("Cannot read include: %s" % err, None, path)
+        stat = (stat.st_mtime_ns, stat.st_size)
+
+        fragment = self.fragments.get(path)
+        text = None
+
+        # An unchanged stat means unchanged text, otherwise the text is compared by its digest
+        if fragment is None or fragment.stat != stat:
+            text = self.read_include(path)
+            digest = hashlib.sha256(text.encode("UTF-8", "surrogatepass")).hexdigest()
+
+            if fragment is not None and fragment.digest == digest:
+                fragment.stat = stat
+            else:
+                fragment = self.load_fragment(path, stat, digest, stack)
+
+        # The text is unchanged, so it only needs compiling again if one of its includes changed
+        if fragment is not None:
+            includes = [(include, self.build(include, stack + (path,)).key) for include, _ in fragment.includes]
+
+            if includes == fragment.includes:
+                self.fragments[path] = fragment
+                return fragment
+
+        if text is None:
+            text = self.read_include(path)
+
+        new_fragment = Fragment(path, stat, hashlib.sha256(text.encode("UTF-8", "surrogatepass")).hexdigest())
+        stream = io.BytesIO()
+
+        try:
+            self.encode_to(text, stream, path, new_fragment, stack)
+        except Compiler.IncludeError:
+            raise
+        except Compiler.CompileError as err:
+            raise Compiler.IncludeError(err.message, err.line, path)
+        except Parser.Error as err:
+            raise Compiler.IncludeError("Unexpected " + repr(err.match.string), err.match.line, path)
+        except ValueError as err:
+            if len(err.args) != 2:
+                raise
+            raise Compiler.IncludeError("Unknown padding type: " + repr(err.args[0]), err.args[1], path)
+
+        new_fragment.byte_array = stream.getvalue()
+        new_fragment.key = self.fragment_key(new_fragment.digest, new_fragment.includes)
+
+        self.fragments[path] = new_fragment
+        self.save_fragment(new_fragment)
+
+        return new_fragment
+
+    def read_include(self, path) -> str:
+        """Reads the text of an included file"""
+
+        try:
+            with open(path) as fp:
+                return fp.read()
+        except (OSError, UnicodeDecodeError) as err:
+            raise Compiler.IncludeError("Cannot read include: %s" % err, None, path)
+
+    def fragment_key(self, digest, includes) -> str:
+        """Hashes the text of a file together with the keys of the files it includes, so the key of a file changes
+        when any file it includes changes"""
+
+        return hashlib.sha256(repr((self.text_encode, self.pad_size, digest, includes)).encode()).hexdigest()
+
+    def load_fragment(self, path, stat, digest, stack):
+        """Loads a Fragment built by an earlier run from the cache directory, or returns None"""
+
+        if self.cache is None:
+            return None
+
+        record = self.cache.get(self.cache.key("includes %s %s" % (path, digest), self.text_encode, self.pad_size))
+        if record is None:
+            return None
+
+        includes = [(include, self.build(include, stack + (path,)).key) for include in json.loads(record)]
+        key = self.fragment_key(digest, includes)
+
+        record = self.cache.get(self.cache.key("fragment " + key, self.text_encode, self.pad_size))
+        if record is None:
+            return None
+
+        header_size = int.from_bytes(record[:4], "big")
+        header = json.loads(record[4: 4 + header_size])
+
+        fragment = Fragment(path, stat, digest)
+        fragment.key = key
+        fragment.includes = includes
+        fragment.defs = {name: bytes.fromhex(value) for name, value in header["defs"].items()}
+        fragment.pad_defs = header["pad_defs"]
+        fragment.byte_array = record[4 + header_size:]
+
+        return fragment
+
+    def save_fragment(self, fragment):
+        """Saves a Fragment to the cache directory so later runs do not have to compile it"""
+
+        if self.cache is None:
+            return
+
+        includes_key = self.cache.key("includes %s %s" % (fragment.path, fragment.digest), self.text_encode,
+                                      self.pad_size)
+        self.cache.put(includes_key, json.dumps([include for include, _ in fragment.includes]).encode())
+
+        header = json.dumps({
+            "defs": {name: value.hex() for name, value in fragment.defs.items()},
+            "pad_defs": fragment.pad_defs,
+        }).encode()
+        self.cache.put(self.cache.key("fragment " + fragment.key, self.text_encode, self.pad_size),
+                       len(header).to_bytes(4, "big") + header + fragment.byte_array)
+
+    def write_repeated(self, write, byte_array, count) -> int:
+        """Writes byte_array count times, a large block of copies at a time, returning the number of bytes written"""
+
+        if len(byte_array) == 0 or count == 0:
+            return 0
+
+        per_write = max(1, 65536 // len(byte_array))
+        chunk = byte_array * min(per_write, count)
+
+        for _ in range(count // per_write):
+            write(chunk)
+        write(byte_array * (count % per_write))
+
+        return len(byte_array) * count
+
+    def encode_array(self, token, pad_size) -> bytes:
+        """Encodes an array literal token, converting and packing each run of elements of the same type at once
+        rather than one element at a time"""
+
+        if self.array_parser is None:
+            self.array_parser = Parser(consts.ARRAY_REGEX)
+
+            # Matches arrays with elements of only one type
+            separator = consts.ARRAY_REGEX["separator"]
+            self.array_types = {
+                group: re.compile(r"(?:%s)?(?:%s(?:%s%s)*)?(?:%s)?" % (separator, regex, separator, regex, separator))
+                for group, regex in consts.ARRAY_REGEX.items() if group != "separator"
+            }
+
+        string = token.string
+        body = string[1:-1]
+
+        # An array of a single type is split and converted without looking at each element
+        for group, regex in self.array_types.items():
+            if regex.fullmatch(body):
+                if group == "hex":
+                    body = body.replace("#", " ")
+                elif group == "bin":
+                    body = body.replace("_", "")
+
+                return self.pack_array(group, body.replace(",", " ").split(), pad_size)
+
+        matches = self.array_parser.regex.finditer(string, 1, len(string) - 1)
+        byte_arrays = []
+
+        for group, run in itertools.groupby(
+                (match for match in matches if match.lastgroup != "separator"), lambda match: match.lastgroup):
+            if group == self.array_parser.error_name:
+                lines = LineIndex(string, token.start, token.line, token.column)
+                raise Parser.Error(Parser.Match(next(run), lines, token.start))
+
+            if group == "hex":
+                items = [match.group()[1:] for match in run]
+            elif group == "bin":
+                items = [match.group().replace("_", "") for match in run]
+            else:
+                items = [match.group() for match in run]
+
+            byte_arrays.append(self.pack_array(group, items, pad_size))
+
+        return b"".join(byte_arrays)
+
+    def pack_array(self, group, items, pad_size) -> bytes:
+        """Packs a list of element strings of one type, hex elements without their # and bin elements without
+        underscores, into pad_size bytes each as individual tokens would be"""
+
+        if group == "float":
+            return struct.pack(">%d%s" % (len(items), "d" if pad_size is None or pad_size > 4 else "f"),
+                               *map(float, items))
+
+        if group == "hex":
+            nums = list(map(int, items, itertools.repeat(16)))
+        elif group == "bin":
+            nums = list(map(int, items, itertools.repeat(2)))
+        else:
+            nums = list(map(int, items))
+
+        # Hex and binary are the bytes as written, so they are packed unsigned
+        signed = group == "int"
+
+        if pad_size in consts.STRUCT_CODES:
+            code = consts.STRUCT_CODES[pad_size]
+            try:
+                return struct.pack(">%d%s" % (len(nums), code if signed else code.upper()), *nums)
+            except struct.error:
+                # Encode one at a time so an overflow raises the same error as it would outside of an array
+                pass
+
+        return b"".join(
+            num.to_bytes(((num.bit_length() + 7) // 8) if pad_size is None else pad_size, "big", signed=signed)
+            for num in nums
+        )
+
+
+class Fragment:
+    """A compiled file, the definitions it exports and the (path, key) of each file it includes"""
+
+    def __init__(self, path, stat, digest):
+        self.path = path
+        self.stat = stat
+        self.digest = digest
+        self.key = None
+
+        self.byte_array = b""
+        self.defs = {}
+        self.pad_defs = {}
+        self.includes = []
@@ -22,6 +22,26 @@ PAD_DEFS = {
     "u128": 16,
 }
 
+# The struct format codes of the pad sizes that struct can pack signed integers to
+STRUCT_CODES = {
+    1: "b",
+    2: "h",
+    4: "i",
+    8: "q",
+}
+
+# Directives and the argument they take, a size is a number or the name of a pad size and a path is a quoted string
+DIRECTIVES = {
+    "repeat": "size",
+    "end": None,
+    "fill": "size",
+    "align": "size",
+    "include": "path",
+}
+
+# Only these directives take the word after them as their argument, so a value can follow .end on the same line
+_argument_directives = "|".join(name for name, argument in DIRECTIVES.items() if argument is not None)
+
 # Find this in colorizer.py in IdleLib
 _stringprefix = r"(?i:r|u|f|fr|rf|b|br|rb)?"
 _sqstring = _stringprefix + r"'[^'\\\n]*(\\.[^'\\\n]*)*'?"
@@ -33,6 +53,9 @@ REGEX = {
     "def": r"\$[a-zA-Z_][a-zA-Z_0-9]*\=.*",
     "sizedef": r"\@[a-zA-Z_][a-zA-Z_0-9]*\=[0-9]+",
     "pad": r"\[[^\]]*\]",
+    "directive": r"\.((?i:" + _argument_directives + r")[ \t]+([a-zA-Z_0-9]+|\"[^\"\n]*\"|'[^'\n]*')"
+                 r"|[a-zA-Z_][a-zA-Z_0-9]*)",
+    "array": r"\{[^}]*\}",
     "int": r"(\+|\-)[0-9]+",
     "hex": r"\#[a-fA-F0-9]+",
     "float": r"[0-9]*\.[0-9]*",
@@ -42,3 +65,15 @@ REGEX = {
     "comment": r"\/\*(\*(?!\/)|[^*])*\*\/",
     "white_space": r"[\s]*",
 }
+
+# The elements of an array literal, written as they would be outside of one but separated by commas or white space
+ARRAY_REGEX = {
+    "int": r"[+\-][0-9]+",
+    "hex": r"\#[a-fA-F0-9]+",
+    "float": r"[0-9]*\.[0-9]*",
+    "bin": r"[01][01_]*",
+    "separator": r"[\s,]+",
+}
+
+# Text that could still become a directive, array, float, def, sizedef, pad or comment if more text followed it
+PARTIAL_REGEX = r"\.[a-zA-Z_][a-zA-Z_0-9]*([ \t]+(\"[^\"\n]*|'[^'\n]*)?)?|\{[^}]*|[0-9]+|\$([a-zA-Z_][a-zA-Z_0-9]*)?|\@([a-zA-Z_][a-zA-Z_0-9]*\=?)?|\[[^\]]*|\/(\*(\*(?!\/)|[^*])*)?"
@@ -1,8 +1,146 @@
+import io
+import json
+import mmap
+import operator
+import os
 import struct
 import re
+import time
 import compiler.consts as consts
 
 
+def map_file(fp):
+    """Memory maps an open binary file for reading so it can be decompiled without reading it into memory"""
+
+    # Empty files cannot be mapped
+    if os.fstat(fp.fileno()).st_size == 0:
+        return b""
+
+    return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+# Matches each [type:count]format $var reader of a format string
+FORMAT_REGEX = re.compile(r"\[([^:\]]*)\s*(:\s*[^\]]*)?\](x|h|d|b|f|s|c|r|\!|\?)?\s*(\$[a-zA-Z0-9_]+)?")
+
+# Raw blobs and left over bytes are written as hex literals of this many bytes per line
+BLOB_WIDTH = 32
+
+# Fields with more elements than this are formatted and yielded a block of elements at a time
+BLOCK_SIZE = 4096
+
+# Each hex digit as its four binary digits
+HEX_TO_BIN = str.maketrans({digit: format(int(digit, 16), "04b") for digit in "0123456789abcdef"})
+
+# Float text the compiler reads back as a single float, it has no sign or exponent
+FLOAT_REGEX = re.compile(consts.REGEX["float"])
+
+
+def format_hex(view, width, count, line_start, plan=None) -> str:
+    """Formats count elements of width bytes as hex literal lines, keeping leading zeros so they compile back to
+    the same bytes"""
+
+    if len(view) != width * count or width == 0:
+        return "".join(line_start + "#" + view[i * width: (i + 1) * width].hex() + "\n" for i in range(count))
+
+    # bytes.hex puts a newline between every element, so no element is formatted on its own
+    return line_start + "#" + view.hex("\n", width).replace("\n", "\n" + line_start + "#") + "\n"
+
+
+def format_bin(view, width, count, line_start, plan=None) -> str:
+    """Formats count elements of width bytes as binary literal lines of 8 digits per byte"""
+
+    if len(view) != width * count or width == 0:
+        return "".join(line_start + view[i * width: (i + 1) * width].hex().translate(HEX_TO_BIN) + "\n"
+                       for i in range(count))
+
+    return line_start + view.hex("\n", width).translate(HEX_TO_BIN).replace("\n", "\n" + line_start) + "\n"
+
+
+def unpack_ints(view, width, count, signed=True):
+    """Converts count elements of width bytes to integers, in one call when struct has a format for the width"""
+
+    if len(view) == width * count and width in consts.STRUCT_CODES:
+        code = consts.STRUCT_CODES[width]
+        return struct.unpack(">%d%s" % (count, code if signed else code.upper()), view)
+
+    return [int.from_bytes(view[i * width: (i + 1) * width], "big", signed=signed) for i in range(count)]
+
+
+def format_int(view, width, count, line_start, plan=None) -> str:
+    """Formats count elements of width bytes as signed integer lines"""
+
+    template = line_start.replace("%", "%%") + "%+d\n"
+    return "".join([template % value for value in unpack_ints(view, width, count)])
+
+
+def format_float(view, width, count, line_start, plan=None) -> str:
+    """Formats count elements of width bytes as float lines, 8 byte doubles when wider than 4 bytes, elements
+    whose text would not compile back to the same float are formatted as hex literal lines"""
+
+    code = "d" if width > 4 else "f"
+    size = struct.calcsize(code)
+
+    if len(view) == width * count and width == size:
+        values = struct.unpack(">%d%s" % (count, code), view)
+    else:
+        values = [struct.unpack(">" + code, view[i * width: (i + 1) * width])[0] for i in range(count)]
+
+    lines = []
+    for i, value in enumerate(values):
+        text = str(value)
+        if FLOAT_REGEX.fullmatch(text):
+            lines.append(line_start + text + "\n")
+        else:
+            lines.append(format_hex(view[i * width: (i + 1) * width], width, 1, line_start))
+
+    return "".join(lines)
+
+
+def format_define(view, width, count, line_start, plan) -> str:
+    """Formats count elements of width bytes as the names of the plan's defines, or as signed integer lines"""
+
+    lines = []
+    signed = unpack_ints(view, width, count)
+    unsigned = unpack_ints(view, width, count, signed=False)
+
+    # The indent is everything before the step's [type] prefix
+    indent = line_start[:line_start.index("[")]
+
+    for as_int, as_uint in zip(signed, unsigned):
+        if as_int in plan.signed_defines:
+            lines.append(indent + str(plan.signed_defines[as_int]) + "\n")
+        elif as_uint in plan.unsigned_defines:
+            lines.append(indent + str(plan.unsigned_defines[as_uint]) + "\n")
+        else:
+            lines.append("%s%+d\n" % (line_start, as_int))
+
+    return "".join(lines)
+
+
+# The formatter of each field format that formats every element the same way
+FORMATTERS = {
+    "h": format_hex,
+    "b": format_bin,
+    "d": format_int,
+    "f": format_float,
+    "!": format_define,
+}
+
+
+def iter_blob(view, line_start=""):
+    """Yields bytes as raw blob lines of BLOB_WIDTH bytes with explicit pad sizes, a block of lines at a time"""
+
+    full = len(view) - len(view) % BLOB_WIDTH
+    block = BLOB_WIDTH * BLOCK_SIZE
+
+    for start in range(0, full, block):
+        part = view[start: min(start + block, full)]
+        yield format_hex(part, BLOB_WIDTH, len(part) // BLOB_WIDTH, line_start + "[%d] " % BLOB_WIDTH)
+
+    if full != len(view):
+        yield format_hex(view[full:], len(view) - full, 1, line_start + "[%d] " % (len(view) - full))
+
+
 class Reader:
     def __init__(self, type_, fmt="h", length=1, var_name=None):
         self.type = type_
@@ -21,11 +159,125 @@ class Reader:
         return self.__str__()
 
 
+class Step:
+    """A reader with its byte width, repeat count and struct references resolved"""
+
+    __slots__ = ("type", "fmt", "width", "count", "var_name", "struct", "switch", "prefix")
+
+    def __init__(self, type_, fmt, width, count=1, var_name=None, struct=None, switch=None):
+        self.type = type_
+        self.fmt = fmt
+        self.width = width
+        self.count = count
+        self.var_name = var_name
+        self.struct = struct
+        self.switch = switch
+        self.prefix = "[" + type_ + "] "
+
+    def __str__(self):
+        """Converts to the form it has in a format string"""
+
+        return "[" + self.type + ("" if self.count == 1 else ":" + str(self.count)) + "]" + (
+            "" if self.fmt == "struct" else self.fmt) + (" " + self.var_name if self.var_name else "")
+
+    def __repr__(self):
+        """Converts to human-readable form"""
+
+        return "Step(" + self.type + ", " + self.fmt + ", " + str(self.width) + ", " + str(self.count) + ")"
+
+
+class Plan:
+    """A compiled format string, decompiling only has to execute its steps"""
+
+    def __init__(self, name, defines):
+        self.name = name
+        self.defines = defines
+        self.steps = ()
+
+        # The number of bytes every record takes, or None if it depends on what is read
+        self.width = None
+
+        # Defines by their value, decimal keys match signed values and hex keys match unsigned values
+        self.signed_defines = {}
+        self.unsigned_defines = {}
+
+        for key, value in defines.items():
+            if key[:1] == "#":
+                self.unsigned_defines[int(key[1:], 16)] = value
+            elif key.lstrip("+-").isdigit():
+                self.signed_defines[int(key)] = value
+
+    def __repr__(self):
+        """Converts to human-readable form"""
+
+        return "Plan(" + self.name + ", " + repr(self.steps) + ")"
+
+
+class Query:
+    """A filter on the records of one struct such as "@module.$length>100", several conditions joined by commas
+    must all hold, variables are compared as the signed integers they are read as"""
+
+    regex = re.compile(
+        r"\s*(@[a-zA-Z0-9_]+)\.(\$[a-zA-Z0-9_]+)\s*(==|!=|<=|>=|=|<|>)\s*([+\-]?(?:#[0-9a-fA-F]+|[0-9]+))\s*$")
+
+    operators = {
+        "=": operator.eq,
+        "==": operator.eq,
+        "!=": operator.ne,
+        "<": operator.lt,
+        "<=": operator.le,
+        ">": operator.gt,
+        ">=": operator.ge,
+    }
+
+    def __init__(self, string):
+        self.string = string
+        self.struct = None
+        self.conditions = []
+
+        for part in string.split(","):
+            match = self.regex.match(part)
+            if match is None:
+                raise ValueError(part)
+
+            struct_name, var, op, value = match.groups()
+            if self.struct is not None and struct_name != self.struct:
+                raise ValueError("Every condition must be on the same struct: " + string)
+            self.struct = struct_name
+
+            sign = -1 if value[0] == "-" else 1
+            value = value.lstrip("+-")
+            value = int(value[1:], 16) if value[0] == "#" else int(value)
+
+            self.conditions.append((var, self.operators[op], sign * value))
+
+    def test(self, def_vars) -> bool:
+        """Checks a record's variables against every condition"""
+
+        for var, compare, value in self.conditions:
+            if var not in def_vars:
+                raise NameError(var)
+
+            if not compare(def_vars[var], value):
+                return False
+
+        return True
+
+    def __repr__(self):
+        """Converts to human-readable form"""
+
+        return "Query(" + self.string + ")"
+
+
 class Decompiler:
-    def __init__(self, text_encode="UTF-8", pad_size=4):
-        self.regex = re.compile(r"\[([^:\]]*)\s*(:\s*[^\]]*)?\](x|h|d|b|f|s|c|\!|\?)?\s*(\$[a-zA-Z0-9_]+)?")
+    def __init__(self, text_encode="UTF-8", pad_size=4, stats=None):
+        self.regex = FORMAT_REGEX
         self.text_encode = text_encode
         self.pad_size = pad_size
+        self.plans = {}
+
+        # A Stats that records decoded and time per phase are counted in
+        self.stats = stats
 
     def read_format(self, format_string):
         """Converts a format string into a array of Reader classes"""
@@ -54,120 +306,383 @@ class Decompiler:
 
         return reader
 
-    def decompile(self, rules, binary, indent=0):
-        """Decompiles binary data back to input string by following a set of rules"""
+    def plan(self, rules):
+        """Returns the Plan for a set of rules, compiling it the first time the rules are seen"""
 
-        readers = self.read_format(rules["format"])
+        key = json.dumps(rules, sort_keys=True)
 
-        def_vars = {}
-        index = 0
-        string = ""
-        indent_string = " " * (4 * indent)
+        if key not in self.plans:
+            start = time.perf_counter()
+            self.plans[key] = self.compile_rules(rules)
+
+            if self.stats is not None:
+                self.stats.times["plan"] += time.perf_counter() - start
+
+        return self.plans[key]
+
+    def compile_rules(self, rules):
+        """Compiles a set of rules into a Plan, resolving every width, count, struct and switch table once"""
+
+        return self.compile_plan("format", rules["format"], rules, {})
+
+    def compile_plan(self, name, format_string, rules, plans):
+        """Compiles a single format string into a Plan, sharing struct plans through the plans dictionary"""
+
+        if name in plans:
+            return plans[name]
+
+        # Register the plan before compiling its steps so structs can refer to themselves
+        plan = plans[name] = Plan(name, rules["defines"])
+        steps = []
+
+        for code in self.read_format(format_string):
+            count = 1 if code.length is None else code.length
+            if type(count) == str and count.isdigit():
+                count = int(count)
 
-        for code in readers:
             if code.type in rules["sizes"]:
-                n_bytes = rules["sizes"][code.type]
+                width = rules["sizes"][code.type]
 
             elif type(code.type) == int:
-                n_bytes = code.type
+                width = code.type
 
             elif code.type in consts.PAD_DEFS:
-                n_bytes = consts.PAD_DEFS[code.type]
+                width = consts.PAD_DEFS[code.type]
 
             elif code.type in rules["structs"]:
-                new_rules = rules.copy()
-                new_rules["format"] = rules["structs"][code.type]
+                struct_plan = self.compile_plan(code.type, rules["structs"][code.type], rules, plans)
+                steps.append(Step(code.type, "struct", 0, count, code.var_name, struct=struct_plan))
+                continue
 
-                for n in range(self.get_var(code.length, def_vars)):
-                    s, i = self.decompile(new_rules, binary[index:], indent=indent + 1)
+            elif code.fmt == "?":
+                switch = {}
+                for case in code.type.split(","):
+                    value, struct_name = case.split("=", 1)
+                    struct_name = struct_name.strip()
 
-                    index += i
-                    string += indent_string + s
+                    if struct_name not in rules["structs"]:
+                        raise TypeError(struct_name)
+
+                    switch[int(value)] = self.compile_plan(struct_name, rules["structs"][struct_name], rules, plans)
+
+                steps.append(Step(code.type, "?", 0, count, code.var_name, switch=switch))
                 continue
 
-            elif code.fmt == "?":
-                n_bytes = 0
             else:
                 raise TypeError(code.type)
 
-            byte_array = binary[index: index + n_bytes]
+            fmt = {None: "d", "x": "h", "c": "s"}.get(code.fmt, code.fmt)
+            steps.append(Step(str(code.type), fmt, width, count, code.var_name))
 
-            if code.fmt == "f":
-                for n in range(self.get_var(code.length, def_vars)):
-                    value = struct.unpack('>' + ("d" if size > 4 else "f"), byte_array)[0]
-                    string += indent_string + "[" + str(code.type) + "] " + str(value) + "\n"
+        plan.steps = tuple(steps)
+        plan.width = self.plan_width(plan.steps)
+        return plan
 
-                    index += n_bytes
+    def plan_width(self, steps):
+        """Gets the number of bytes a plan's steps always read, or None if it depends on the variables read or on
+        the struct a switch picks, plans with a width can be skipped over without reading them"""
 
-            elif code.fmt == "b":
-                for n in range(self.get_var(code.length, def_vars)):
-                    as_str = ''.join(bin(byte)[2:] for byte in byte_array)
-                    string += indent_string + "[" + str(code.type) + "] " + as_str + "\n"
+        width = 0
 
-                    index += n_bytes
+        for step in steps:
+            if type(step.count) != int or step.fmt == "?":
+                return None
+            elif step.fmt == "struct":
+                if step.struct.width is None:
+                    return None
+                width += step.struct.width * step.count
+            else:
+                width += step.width * step.count
 
-            elif code.fmt == "?":
-                defs_ = {int(s.split("=", 1)[0]): s.split("=", 1)[1] for s in code.type.split(",")}
-                var_ = def_vars[code.var_name]
+        return width
 
-                new_rules = rules.copy()
-                new_rules["format"] = rules["structs"][defs_[var_]]
+    def decompile(self, rules, binary, indent=0):
+        """Decompiles binary data back to input string by following a set of rules"""
 
-                for n in range(self.get_var(code.length, def_vars)):
-                    s, i = self.decompile(new_rules, binary[index:], indent=indent + 1)
+        stream = io.StringIO()
+        index = self.decompile_to(rules, binary, stream, indent)
 
-                    index += i
-                    string += indent_string + s
-                    continue
+        return stream.getvalue(), index
 
-            elif code.fmt in ["h", "x"]:
-                for n in range(self.get_var(code.length, def_vars)):
-                    as_str = ''.join(hex(byte)[2:] for byte in byte_array)
-                    string += indent_string + "[" + str(code.type) + "] #" + as_str + "\n"
+    def decompile_to(self, rules, binary, stream, indent=0):
+        """Decompiles binary data writing each line to a text stream as it is decoded, returning the number of
+        bytes read"""
 
-                    index += n_bytes
+        return self.write_plan(self.plan(rules), memoryview(binary), 0, stream, indent)
 
-            elif code.fmt in ["c", "s"]:
-                n_bytes = n_bytes * self.get_var(code.length, def_vars)
-                byte_array = binary[index: index + n_bytes]
-                index += n_bytes
+    def iter_decompile(self, rules, binary, indent=0, path=None):
+        """Decompiles binary data yielding each line as it is decoded, the generator returns the number of bytes
+        read, path is kept as iter_plan keeps it"""
+
+        return self.iter_plan(self.plan(rules), memoryview(binary), 0, indent, path)
+
+    def write_plan(self, plan, view, offset, stream, indent=0):
+        """Executes a plan over the binary data in a memoryview starting at offset, writing each line to a text
+        stream and returning the number of bytes read"""
+
+        result = []
 
-                s = byte_array.decode(self.text_encode)
+        def lines():
+            result.append((yield from self.iter_plan(plan, view, offset, indent)))
 
-                string += indent_string + repr(s) + "\n"
+        stats = self.stats
+        if stats is None:
+            stream.writelines(lines())
+        else:
+            # Time spent writing is the time not spent decoding the lines
+            start = time.perf_counter()
+            decoding = stats.times["decode"]
+            stream.writelines(stats.timed("decode", lines()))
+            stats.times["write"] += time.perf_counter() - start - (stats.times["decode"] - decoding)
+
+        return result[0] - offset
+
+    def iter_plan(self, plan, view, offset, indent=0, path=None):
+        """Executes a plan over the binary data in a memoryview starting at offset, yielding a line or a block of
+        lines at a time as they are decoded, the generator returns the offset after the last byte read
+
+        If path is a list, the (step or record, offset it starts at) of each step being decoded is kept in it, from
+        the outermost to the innermost"""
+
+        def_vars = {}
+        index = offset
+        indent_string = " " * (4 * indent)
+
+        if path is not None:
+            path.append(None)
+
+        for step in plan.steps:
+            fmt = step.fmt
+            n_bytes = step.width
+            count = self.get_var(step.count, def_vars)
 
-            elif code.fmt in ["d", None]:
-                for n in range(self.get_var(code.length, def_vars)):
-                    as_int = int.from_bytes(byte_array, "big", signed=True)
-                    string += indent_string + "[" + str(code.type) + "] " + ("-" if as_int < 0 else "+") + str(
-                        as_int) + "\n"
+            if path is not None:
+                path[-1] = (str(step), index)
 
-                    index += n_bytes
+            if fmt == "struct" or fmt == "?":
+                struct_plan = step.struct if fmt == "struct" else step.switch[def_vars[step.var_name]]
 
-            elif code.fmt == "!":
-                for n in range(self.get_var(code.length, def_vars)):
-                    as_int = int.from_bytes(byte_array, "big", signed=True)
-                    as_hex = ''.join(hex(byte)[2:] for byte in byte_array)
+                if self.stats is not None:
+                    self.stats.records[struct_plan.name] += count
+                    self.stats.max_depth = max(self.stats.max_depth, indent + 1)
 
-                    if str(as_int) in rules["defines"]:
-                        value = str(rules["defines"][str(as_int)])
+                for n in range(count):
+                    if path is not None:
+                        path.append((struct_plan.name + "[" + str(n) + "]", index))
 
-                    elif "#" + as_hex in rules["defines"]:
-                        value = str(rules["defines"]["#" + as_hex])
+                    index = yield from self.iter_plan(struct_plan, view, index, indent + 1, path)
 
-                    else:
-                        value = "[" + str(code.type) + "] " + ("-" if as_int < 0 else "+") + str(as_int)
+                    if path is not None:
+                        path.pop()
+                continue
+
+            # Variables take the value of the last element read, or of the next bytes if none were read
+            byte_array = view[index: index + n_bytes]
 
-                    string += indent_string + value + "\n"
-                    index += n_bytes
+            if fmt == "s":
+                n_bytes = n_bytes * count
+                byte_array = view[index: index + n_bytes]
+                index += n_bytes
+
+                yield indent_string + repr(str(byte_array, self.text_encode)) + "\n"
+
+            elif fmt == "r":
+                n_bytes = n_bytes * count
+                byte_array = view[index: index + n_bytes]
+                index += n_bytes
+
+                yield from iter_blob(byte_array, indent_string)
+
+            elif fmt in FORMATTERS:
+                # Elements are formatted a block at a time, so large fields never become one huge string
+                for start in range(0, count, BLOCK_SIZE):
+                    block_count = min(BLOCK_SIZE, count - start)
+                    block = view[index: index + n_bytes * block_count]
+                    index += n_bytes * block_count
+
+                    yield FORMATTERS[fmt](block, n_bytes, block_count, indent_string + step.prefix, plan)
+
+                if count:
+                    byte_array = view[index - n_bytes: index]
 
             else:
-                raise 1234
+                raise TypeError(fmt)
+
+            if step.var_name:
+                def_vars[step.var_name] = int.from_bytes(byte_array, "big", signed=True)
+
+        if path is not None:
+            path.pop()
+
+        return index
+
+    def skip_plan(self, plan, view, offset, records=None, def_vars=None) -> int:
+        """Executes a plan over the binary data in a memoryview like iter_plan without formatting anything, returning
+        the offset after the last byte read, the (struct plan, offset, end) of each record read by the plan's own
+        steps is appended to records if it is given and the plan's variables are left in def_vars if it is given"""
+
+        if def_vars is None:
+            def_vars = {}
+        index = offset
+
+        for step in plan.steps:
+            fmt = step.fmt
+            n_bytes = step.width
+            count = self.get_var(step.count, def_vars)
+
+            if fmt == "struct" or fmt == "?":
+                struct_plan = step.struct if fmt == "struct" else step.switch[def_vars[step.var_name]]
+
+                if struct_plan.width is not None:
+                    # Records that are always the same size are skipped without reading them
+                    if records is not None:
+                        records.extend((struct_plan, index + struct_plan.width * n, index + struct_plan.width * (n + 1))
+                                       for n in range(count))
+                    index += struct_plan.width * count
+
+                elif records is not None:
+                    for n in range(count):
+                        start = index
+                        index = self.skip_plan(struct_plan, view, index)
+                        records.append((struct_plan, start, index))
+
+                else:
+                    for n in range(count):
+                        index = self.skip_plan(struct_plan, view, index)
+                continue
+
+            if step.var_name:
+                def_vars[step.var_name] = self.read_var(fmt, view, index, n_bytes, count)
+            elif fmt != "s" and fmt != "r" and fmt not in FORMATTERS:
+                raise TypeError(fmt)
+
+            index += n_bytes * count
+
+        return index
+
+    def read_var(self, fmt, view, index, n_bytes, count) -> int:
+        """Reads the value a variable takes from a field, the same bytes iter_plan gives it"""
+
+        if fmt == "s" or fmt == "r":
+            byte_array = view[index: index + n_bytes * count]
+        elif fmt in FORMATTERS:
+            byte_array = view[index + n_bytes * (count - 1): index + n_bytes * count] if count else \
+                view[index: index + n_bytes]
+        else:
+            raise TypeError(fmt)
+
+        return int.from_bytes(byte_array, "big", signed=True)
+
+    def iter_where(self, rules, binary, query):
+        """Decompiles only the records of binary data that match a Query, yielding the lines of each after a comment
+        of which record it is and where it starts, the generator returns the number of records that matched"""
+
+        plan = self.plan(rules)
+        view = memoryview(binary)
+
+        if query.struct not in rules["structs"]:
+            raise NameError(query.struct)
+
+        counts = [0, 0]
+        yield from self.iter_matches(plan, view, 0, query, counts)
+        return counts[1]
+
+    def decompile_where(self, rules, binary, query, stream) -> int:
+        """Decompiles only the records of binary data that match a Query, writing them to a text stream and returning
+        the number of records that matched"""
+
+        result = []
+
+        def lines():
+            result.append((yield from self.iter_where(rules, binary, query)))
+
+        stream.writelines(lines())
+        return result[0]
+
+    def iter_matches(self, plan, view, offset, query, counts):
+        """Executes a plan like skip_plan, decompiling the records of the query's struct that match it, counts holds
+        the number of records of the struct seen and matched so far, the generator returns the offset after the last
+        byte read"""
+
+        def_vars = {}
+        index = offset
+
+        for step in plan.steps:
+            fmt = step.fmt
+            n_bytes = step.width
+            count = self.get_var(step.count, def_vars)
+
+            if fmt == "struct" or fmt == "?":
+                struct_plan = step.struct if fmt == "struct" else step.switch[def_vars[step.var_name]]
+
+                for n in range(count):
+                    if struct_plan.name != query.struct:
+                        index = yield from self.iter_matches(struct_plan, view, index, query, counts)
+                        continue
+
+                    # Records are tested on their raw variables, only the ones that match are formatted
+                    record_vars = {}
+                    end = self.skip_plan(struct_plan, view, index, def_vars=record_vars)
+
+                    if query.test(record_vars):
+                        yield "/* record %d %s at offset %d */\n" % (counts[0], struct_plan.name, index)
+                        yield from self.iter_plan(struct_plan, view, index, 1)
+                        counts[1] += 1
+
+                    counts[0] += 1
+                    index = end
+                continue
+
+            if step.var_name:
+                def_vars[step.var_name] = self.read_var(fmt, view, index, n_bytes, count)
+
+            index += n_bytes * count
+
+        return index
+
+    def locate(self, rules, binary, offset) -> list:
+        """Finds the steps and records that decoded the byte at offset, from the outermost to the innermost, each as
+        (step or record, offset it starts at), an empty list means the byte was left over"""
+
+        path = []
+        found = []
+        lines = self.iter_plan(self.plan(rules), memoryview(binary), 0, path=path)
+
+        # Steps start in order, so the byte belongs to the last step that started at or before it
+        while True:
+            try:
+                next(lines)
+            except StopIteration as stop:
+                if offset >= stop.value:
+                    found = []
+                break
+
+            if path[-1][1] > offset:
+                break
+            found = path[:]
+
+        lines.close()
+        return found
+
+    def iter_script(self, rules, binary, path=None):
+        """Yields the whole hw script for binary data as the command line writes it, the header, the decoded lines
+        and then the left over bytes, path is kept as iter_plan keeps it while the lines are decoded"""
+
+        yield self.get_header(rules) + "\n"
+
+        index = yield from self.iter_decompile(rules, binary, path=path)
+
+        # append the left over bytes
+        if index != len(binary):
+            yield "\n"
+            yield from self.iter_leftover(binary, index)
+
+        yield "\n"
 
-            if code.var_name:
-                def_vars[code.var_name] = int.from_bytes(byte_array, "big", signed=True)
+    def iter_leftover(self, binary, index):
+        """Yields the bytes after index as raw blob lines a block at a time"""
 
-        return string, index
+        return iter_blob(memoryview(binary)[index:])
 
     def get_header(self, rules):
         """Get the string header from a set of rules"""
@@ -179,9 +694,8 @@ class Decompiler:
 
             if def_[0] == "#":
                 string += str(def_) + "\n"
-            elif def_[0] in "+-":
-                value = int(def_)
-                string += ("-" if value < 0 else "+") + str(value) + "\n"
+            elif def_.lstrip("+-").isdigit():
+                string += "%+d\n" % int(def_)
 
         for size in rules["sizes"]:
             string += "@" + size + "=" + str(rules["sizes"][size]) + "\n"
@@ -193,6 +707,8 @@ class Decompiler:
 
         if s is None:
             return 1
+        elif type(s) == int:
+            return s
         elif s in def_vars:
             return def_vars[s]
         elif s.isdigit():
@@ -0,0 +1,219 @@
+import array
+import bisect
+import hashlib
+import json
+import os
+import struct
+import sys
+
+from compiler.decompiler import map_file
+
+
+class RecordIndex:
+    """The offset of each top level struct record of a binary, so any record can be decoded without decoding the
+    records before it
+
+    The index is stored as a header then the offset and end of every record as 8 byte and the struct it is as a 2
+    byte little endian integers, records are read straight out of the stored data so opening an index reads none of
+    them"""
+
+    # Bump when the stored format changes, so old sidecar files are rebuilt
+    version = 2
+
+    magic = b"HWIX"
+
+    def __init__(self, data):
+        if data[:4] != self.magic:
+            raise ValueError("Not a record index")
+
+        header_size = struct.unpack_from("<I", data, 4)[0]
+        self.header = json.loads(bytes(data[8: 8 + header_size]))
+
+        if not isinstance(self.header, dict):
+            raise ValueError("Not a record index")
+
+        if self.header.get("version") != self.version:
+            raise ValueError("Record index version %r" % self.header.get("version"))
+
+        self.data = data
+        self.names = self.header["names"]
+        self.count = self.header["count"]
+        self.end = self.header["end"]
+
+        self.offsets_at = 8 + header_size
+        self.ends_at = self.offsets_at + 8 * self.count
+        self.structs_at = self.ends_at + 8 * self.count
+
+        if len(data) != self.structs_at + 2 * self.count:
+            raise ValueError("Record index is truncated")
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, n):
+        """Gets the offset of record n"""
+
+        if not 0 <= n < self.count:
+            raise IndexError(n)
+
+        return struct.unpack_from("<Q", self.data, self.offsets_at + 8 * n)[0]
+
+    def record_end(self, n) -> int:
+        """Gets the offset after the last byte of record n"""
+
+        return struct.unpack_from("<Q", self.data, self.ends_at + 8 * n)[0]
+
+    def name(self, n) -> str:
+        """Gets the name of the struct record n is"""
+
+        return self.names[struct.unpack_from("<H", self.data, self.structs_at + 2 * n)[0]]
+
+    def overlapping(self, start, stop=None):
+        """Gets the number of the first record and one past the last record holding any of the bytes from start up
+        to stop, the two are equal when the bytes are all in fields outside of any record"""
+
+        first = bisect.bisect_right(self, start) - 1
+        if first < 0 or self.record_end(first) <= start:
+            first += 1
+
+        last = self.count if stop is None else bisect.bisect_left(self, stop)
+        return first, max(first, last)
+
+
+def index_path(path) -> str:
+    """Gets the sidecar file the record index of a binary file is stored in"""
+
+    return path + ".hwidx"
+
+
+def rules_key(rules) -> str:
+    """Hashes a set of rules, an index is only used with the rules it was built with"""
+
+    return hashlib.sha256(json.dumps(rules, sort_keys=True).encode()).hexdigest()
+
+
+def build_index(hw, rules, binary, stat=None) -> bytes:
+    """Decodes binary data once without formatting it, returning the stored form of its record index"""
+
+    plan = hw.plan(rules)
+    records = []
+    end = hw.skip_plan(plan, memoryview(binary), 0, records)
+
+    names = []
+    ids = {}
+    offsets = array.array("Q")
+    ends = array.array("Q")
+    structs = array.array("H")
+
+    for struct_plan, offset, record_end in records:
+        if struct_plan.name not in ids:
+            ids[struct_plan.name] = len(names)
+            names.append(struct_plan.name)
+
+        offsets.append(offset)
+        ends.append(record_end)
+        structs.append(ids[struct_plan.name])
+
+    if sys.byteorder != "little":
+        offsets.byteswap()
+        ends.byteswap()
+        structs.byteswap()
+
+    header = json.dumps({
+        "version": RecordIndex.version,
+        "rules": rules_key(rules),
+        "size": len(binary),
+        "mtime_ns": None if stat is None else stat.st_mtime_ns,
+        "names": names,
+        "count": len(offsets),
+        "end": end,
+    }).encode()
+
+    return RecordIndex.magic + struct.pack("<I", len(header)) + header + offsets.tobytes() + ends.tobytes() + \
+        structs.tobytes()
+
+
+def load_index(path, rules, stat):
+    """Opens the sidecar record index of a binary file, or returns None if there is none or the file or rules
+    changed since it was built"""
+
+    try:
+        with open(index_path(path), "rb") as fp:
+            index = RecordIndex(map_file(fp))
+
+        header = index.header
+        if header["rules"] != rules_key(rules) or header["size"] != stat.st_size or \
+                header["mtime_ns"] != stat.st_mtime_ns:
+            return None
+    except (OSError, ValueError, KeyError, struct.error):
+        return None
+
+    return index
+
+
+def open_index(hw, rules, path, binary) -> RecordIndex:
+    """Gets the record index of a binary file, building it and saving it next to the file if it is missing or out
+    of date"""
+
+    stat = os.stat(path)
+    index = load_index(path, rules, stat)
+    if index is not None:
+        return index
+
+    data = build_index(hw, rules, binary, stat)
+
+    # Write to a temporary file first so other processes never read a partial index
+    sidecar = index_path(path)
+    temp_path = "%s.%d.tmp" % (sidecar, os.getpid())
+    try:
+        with open(temp_path, "wb") as fp:
+            fp.write(data)
+        os.replace(temp_path, sidecar)
+    except OSError:
+        # The index can still be used from memory when it cannot be saved
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+
+    return RecordIndex(data)
+
+
+def parse_range(string):
+    """Converts "N..M" into (N, M + 1), either side can be left out and a single "N" is just N, numbers can be in
+    any base Python accepts such as 0x10"""
+
+    if ".." in string:
+        start, stop = string.split("..", 1)
+    else:
+        start = stop = string
+
+    start = int(start, 0) if start.strip() else 0
+    stop = int(stop, 0) + 1 if stop.strip() else None
+
+    if start < 0 or (stop is not None and stop <= start):
+        raise ValueError(string)
+
+    return start, stop
+
+
+def iter_records(hw, rules, binary, index, start, stop=None):
+    """Decodes records start to stop of binary data, yielding the lines of each after a comment of which record it
+    is and where it starts"""
+
+    plans = {}
+    for step in hw.plan(rules).steps:
+        if step.struct is not None:
+            plans[step.struct.name] = step.struct
+        elif step.switch is not None:
+            plans.update((case.name, case) for case in step.switch.values())
+
+    view = memoryview(binary)
+    stop = len(index) if stop is None else min(stop, len(index))
+
+    for n in range(start, stop):
+        name = index.name(n)
+        offset = index[n]
+
+        yield "/* record %d %s at offset %d */\n" % (n, name, offset)
+        yield from hw.iter_plan(plans[name], view, offset, 1)
@@ -1,51 +1,122 @@
+import bisect
 import re
 
 
-class Parser:
-    def __init__(self, patterns, error_name="miss_match_error"):
-        if type(patterns) == dict:
-            patterns = list(patterns.items())
+# Compiled tokenizer regexes by their patterns and error name, shared by every Parser with the same patterns so
+# they are only compiled once per process
+TOKENIZERS = {}
+
 
-        self.regex = re.compile(
+def compile_tokenizer(patterns, error_name):
+    """Compiles a list of (name, regex) patterns into one regex of named groups, falling back to the error group"""
+
+    key = (tuple(patterns), error_name)
+
+    if key not in TOKENIZERS:
+        TOKENIZERS[key] = re.compile(
             "|".join(
                 [
                     '(?P<%s>%s)' % (re.escape(name),
                                     (
                                         regex
-                                        if type(regex != re.Pattern)
+                                        if type(regex) != re.Pattern
                                         else regex.pattern)
                                     ) for name, regex in patterns
                 ]
             ) + "|(?P<%s>.)" % error_name)
 
+    return TOKENIZERS[key]
+
+
+class Parser:
+    def __init__(self, patterns, error_name="miss_match_error", partial=None, lookahead=2, stats=None):
+        if type(patterns) == dict:
+            patterns = list(patterns.items())
+
+        self.regex = compile_tokenizer(patterns, error_name)
+
         self.error_name = error_name
 
+        # Text matching partial could still scan differently if more text followed it, and any other token may
+        # look up to lookahead characters past its end, these are carried over to the next chunk when scanning
+        # chunks
+        self.partial = re.compile(partial, re.DOTALL) if type(partial) == str else partial
+        self.lookahead = lookahead
+
+        # A Stats that the tokens scanned are counted in
+        self.stats = stats
+
     def scan(self, string, remove=None, ignore_errors=False):
         """Scans a string with the compiled regex finding matches and returning them, removing any groups specified"""
 
+        return list(self.iter_scan([string], remove, ignore_errors))
+
+    def iter_scan(self, chunks, remove=None, ignore_errors=False):
+        """Lazily scans text given as an iterable of chunks, yielding each match as it is found, removing any groups
+        specified, tokens that may continue past the end of a chunk are carried over to the next one"""
+
         if remove is None:
             remove = []
-        tokens = []
 
-        for match in self.regex.finditer(string):
-            if not match:
-                continue
+        regex = self.regex
+        error_name = self.error_name
+        partial = self.partial
+        lookahead = self.lookahead
+        counts = None if self.stats is None else self.stats.tokens
+
+        chunks = iter(chunks)
+        buffer = ""
+        lines = LineIndex(buffer)
+        at_end = False
+        scanned = 0
+
+        while not at_end:
+            # Read at least one chunk, doubling the buffer when a token spans it so long tokens are not rescanned
+            # once per chunk
+            min_length = 2 * len(buffer) if scanned == 0 else 0
+            text = [buffer]
+            length = len(buffer)
+
+            while True:
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    at_end = True
+                    break
+
+                text.append(chunk)
+                length += len(chunk)
+
+                if length > min_length:
+                    break
+
+            buffer = "".join(text)
+            lines = LineIndex(buffer, lines.offset + scanned, lines.line(lines.offset + scanned),
+                              lines.column(lines.offset + scanned))
+            offset = lines.offset
+            scanned = 0
+
+            for match in regex.finditer(buffer):
+                match_start, match_end = match.span()
+                if match_start == match_end:
+                    continue
+
+                if not at_end and (match_end + lookahead >= len(buffer) or partial is not None and partial.fullmatch(
+                        buffer, match_start)):
+                    break
 
-            span = match.span()
-            if span[0] == span[1]:
-                continue
+                if counts is not None:
+                    counts[match.lastgroup] += 1
 
-            match_dict = match.groupdict()
-            if len([name for name in match_dict if match_dict[name] is not None]) != 1:
-                raise NotImplementedError()
+                if match.lastgroup == error_name and not ignore_errors:
+                    raise Parser.Error(Parser.Match(match, lines, offset))
 
-            if match.lastgroup == self.error_name and not ignore_errors:
-                raise Parser.Error(match)
+                if match.lastgroup not in remove:
+                    yield Parser.Match(match, lines, offset)
 
-            if match.lastgroup not in remove:
-                tokens.append(Parser.Match(match))
+                scanned = match_end
 
-        return tokens
+            buffer = buffer[scanned:]
 
     class Error(Exception):
         def __init__(self, match):
@@ -53,14 +124,17 @@ class Parser:
             Exception.__init__(self, self.what())
 
         def what(self):
-            return "Miss Match Error at position %s: %s" % (
-                self.match.start(),
-                repr(self.match.group())
+            return "Miss Match Error at line %s column %s: %s" % (
+                self.match.line,
+                self.match.column,
+                repr(self.match.string)
             )
 
     class Match:
-        def __init__(self, match):
+        def __init__(self, match, lines=None, offset=0):
             self.match = match
+            self.lines = LineIndex(match.string) if lines is None else lines
+            self.offset = offset
 
         def __str__(self):
             return self.string
@@ -74,11 +148,11 @@ class Parser:
 
         @property
         def start(self):
-            return self.match.start()
+            return self.offset + self.match.start()
 
         @property
         def end(self):
-            return self.match.end()
+            return self.offset + self.match.end()
 
         @property
         def string(self):
@@ -90,11 +164,267 @@ class Parser:
 
         @property
         def line(self):
-            return self.match.string[:self.start].count("\n") + 1
+            return self.lines.line(self.start)
 
         @property
         def endline(self):
-            return self.match.string[:self.end].count("\n") + 1
+            return self.lines.line(self.end)
+
+        @property
+        def column(self):
+            return self.lines.column(self.start)
+
+        @property
+        def endcolumn(self):
+            return self.lines.column(self.end)
+
+
+class LineIndex:
+    """Finds the line and column of offsets in a string by bisecting the offsets of its newlines, the newlines
+    are found the first time a position is looked up and shared by every token from the same string
+
+    When the string is part of a larger text, offset, line and column give the position of its first character"""
+
+    def __init__(self, string, offset=0, line=1, column=0):
+        self.string = string
+        self.offset = offset
+        self.first_line = line
+        self.first_column = column
+        self.newlines = None
+
+    def find_newlines(self):
+        """Finds the offset of every newline in the string"""
+
+        newlines = []
+        offset = -1
+
+        for line in self.string.split("\n")[:-1]:
+            offset += len(line) + 1
+            newlines.append(offset)
+
+        self.newlines = newlines
+
+    def line(self, offset):
+        """Gets the line number of an offset, starting at 1"""
+
+        if self.newlines is None:
+            self.find_newlines()
+
+        return bisect.bisect_left(self.newlines, offset - self.offset) + self.first_line
+
+    def column(self, offset):
+        """Gets the column of an offset, starting at 0 like a Tk text index"""
+
+        if self.newlines is None:
+            self.find_newlines()
+
+        offset -= self.offset
+        line = bisect.bisect_left(self.newlines, offset)
+        return self.first_column + offset if line == 0 else offset - self.newlines[line - 1] - 1
+
+
+class IncrementalScanner:
+    """Keeps the tokens of a document up to date, re-scanning only the text around each edit
+
+    `partial` is a regex matching text that could still scan differently if more text followed it, such as an
+    unterminated pad or comment, and `lookahead` is how many characters past its end any other token may look at"""
+
+    def __init__(self, parser, remove=None, partial=None, lookahead=None, chunk_size=1024):
+        self.parser = parser
+        self.remove = [] if remove is None else remove
+        self.partial = parser.partial if partial is None else (
+            re.compile(partial, re.DOTALL) if type(partial) == str else partial)
+        self.lookahead = parser.lookahead if lookahead is None else lookahead
+        self.chunk_size = chunk_size
+        self.length = 0
+
+        # Tokens are (start, end, group) tuples split around a gap at the last edit, tokens before the gap are
+        # stored with their offsets and tokens after it are stored nearest first as distances from the end of
+        # the document, so edits never have to shift the tokens after them
+        self.head = []
+        self.tail = []
+
+        # Starts of the errors that run to the end of the document as a partial match
+        self.open_errors = []
+
+    def tokens(self):
+        """Returns every token as a (start, end, group) tuple"""
+
+        length = self.length
+        return self.head + [(length - start, length - end, group) for start, end, group in reversed(self.tail)]
+
+    def reset(self, text, cancelled=None):
+        """Scans a whole document, returning every token, or None if cancelled() returned True part way through"""
+
+        open_errors = []
+        head = []
+
+        for token in self.lex(lambda start, end: text[start:end], 0, len(text), open_errors, len(text)):
+            head.append(token)
+
+            if cancelled is not None and len(head) % 4096 == 0 and cancelled():
+                return None
+
+        self.length = len(text)
+        self.head = head
+        self.tail = []
+        self.open_errors = open_errors
+
+        return head
+
+    def edit(self, start, removed, added, get_text):
+        """Updates the tokens after `removed` characters at start were replaced by `added` characters,
+        get_text(start, end) must return text from the edited document
+
+        Returns (begin, end, tokens) where tokens are the new tokens between begin and end, the tokens outside
+        that range did not change"""
+
+        edit_end = start + added
+        new_length = self.length + added - removed
+
+        # Re-scan from the token before the first token that looked at the edited text, as a failed match of
+        # that token may have looked at it too
+        self.move_gap(start - self.lookahead)
+        while self.head and self.partial is not None and self.partial.fullmatch(get_text(self.head[-1][0], start)):
+            self.tail.append(self.to_tail(self.head.pop(), self.length))
+        if self.head:
+            self.tail.append(self.to_tail(self.head.pop(), self.length))
+
+        # An open error before the edit is re-scanned once the edit ends its partial match
+        for error_start in self.open_errors:
+            if error_start >= start:
+                break
+
+            if not self.partial.fullmatch(get_text(error_start, min(edit_end + 1, new_length))):
+                self.move_gap(error_start)
+                break
+
+        # The tail is stored from the end of the document so it moves with the new length
+        old_length = self.length
+        length = self.length = new_length
+
+        begin = self.head[-1][1] if self.head else 0
+        tail = self.tail
+        new_tokens = []
+        new_errors = []
+        sync = length
+
+        for token in self.lex(get_text, begin, length, new_errors):
+            token_start = token[0]
+
+            while tail and length - tail[-1][0] < token_start:
+                tail.pop()
+
+            # Tokens starting at the same place after the edit are scanned from identical text
+            if token_start >= edit_end and tail and length - tail[-1][0] == token_start:
+                sync = token_start
+                break
+
+            new_tokens.append(token)
+        else:
+            tail.clear()
+
+        self.head.extend(new_tokens)
+
+        # Keep the open errors outside of the re-scanned range and add the new ones inside it
+        old_sync = sync - (length - old_length)
+        self.open_errors = [offset for offset in self.open_errors if offset < begin] + [
+            offset for offset in new_errors if offset < sync
+        ] + [offset + length - old_length for offset in self.open_errors if offset >= old_sync]
+
+        return begin, sync, new_tokens
+
+    def move_gap(self, offset):
+        """Moves the gap so the head holds exactly the tokens ending before offset"""
+
+        head, tail, length = self.head, self.tail, self.length
+
+        while head and head[-1][1] >= offset:
+            tail.append(self.to_tail(head.pop(), length))
+
+        while tail and length - tail[-1][1] < offset:
+            start, end, group = tail.pop()
+            head.append((length - start, length - end, group))
+
+    def lex(self, get_text, start, end, open_errors=None, chunk_size=None):
+        """Lazily scans the text between start and end a chunk at a time, yielding (start, end, group) tuples
+        and adding the starts of open errors to open_errors"""
+
+        regex = self.parser.regex
+        error_name = self.parser.error_name
+        partial = self.partial
+        lookahead = self.lookahead
+        remove = self.remove
+        chunk_size = size = self.chunk_size if chunk_size is None else chunk_size
+
+        while start < end:
+            chunk_end = min(start + size, end)
+            text = get_text(start, chunk_end)
+            at_end = chunk_end == end
+            scanned = 0
+
+            for match in regex.finditer(text):
+                match_start, match_end = match.span()
+                if match_start == match_end:
+                    continue
+
+                # A token near the end of the chunk or a partial match may continue in the next chunk
+                if not at_end:
+                    if match_end + lookahead >= len(text) or partial is not None and partial.fullmatch(
+                            text, match_start):
+                        break
+
+                elif open_errors is not None and match.lastgroup == error_name and partial is not None and \
+                        partial.fullmatch(text, match_start):
+                    open_errors.append(start + match_start)
+
+                if match.lastgroup not in remove:
+                    yield start + match_start, start + match_end, match.lastgroup
+                scanned = match_end
+            else:
+                scanned = len(text)
+
+            if scanned:
+                start += scanned
+                size = chunk_size
+            else:
+                size *= 2
+
+    @staticmethod
+    def to_tail(token, length):
+        """Converts a token to be stored after the gap"""
+
+        start, end, group = token
+        return length - start, length - end, group
+
+
+def read_chunks(fp, chunk_size=65536):
+    """Reads a text file a chunk at a time"""
+
+    chunk = fp.read(chunk_size)
+
+    while chunk:
+        yield chunk
+        chunk = fp.read(chunk_size)
+
+
+def join_chunks(strings, chunk_size=65536):
+    """Joins an iterable of short strings, such as lines, into chunks of about chunk_size characters"""
+
+    parts = []
+    size = 0
+
+    for string in strings:
+        parts.append(string)
+        size += len(string)
+
+        if size >= chunk_size:
+            yield "".join(parts)
+            parts = []
+            size = 0
+
+    if parts:
+        yield "".join(parts)
 
 
 def anyof(*arr):
@@ -0,0 +1,291 @@
+import base64
+import codecs
+import json
+import os
+import signal
+import socket
+import socketserver
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from compiler.compiler import Compiler
+from compiler.cache import CompileCache
+from compiler.batch import compile_error_message, decompile_error_message
+from compiler.decompiler import Decompiler, map_file
+from compiler.watch import write_atomic
+
+# The compilers of this process by (text encode, pad size, include dirs) and its decompilers by (text encode,
+# pad size), kept between requests so their tokenizers, plans and caches stay warm
+compilers = {}
+decompilers = {}
+cache_dir = None
+
+# JSON-RPC error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+COMPILE_ERROR = 1
+DECOMPILE_ERROR = 2
+
+
+class RequestError(Exception):
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+
+
+def init_worker(directory, ignore_interrupt=False):
+    """Sets the cache directory of the compilers created by this process, worker processes ignore Ctrl+C as the
+    server stops them itself"""
+
+    global cache_dir
+    cache_dir = directory
+
+    if ignore_interrupt:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def read_options(params):
+    """Gets the (text encode, pad size) params of a request, raising RequestError if they are not valid"""
+
+    text_encode = params.get("encoding", "UTF-8")
+    pad_size = params.get("pad_size", 4)
+
+    try:
+        codecs.lookup(text_encode)
+    except (LookupError, TypeError):
+        raise RequestError(INVALID_PARAMS, "Unknown encoding: %r" % (text_encode,))
+
+    if type(pad_size) != int or pad_size < 1:
+        raise RequestError(INVALID_PARAMS, "pad_size must be a positive integer, got %r" % (pad_size,))
+
+    return text_encode, pad_size
+
+
+def get_compiler(text_encode, pad_size, include_dirs) -> Compiler:
+    """Gets this process's compiler for the options, creating it the first time, each set of include directories
+    has its own compiler as the files it built found their includes through them"""
+
+    key = (text_encode, pad_size, tuple(include_dirs))
+    if key not in compilers:
+        compilers[key] = Compiler(text_encode, pad_size, CompileCache(cache_dir), list(include_dirs))
+
+    return compilers[key]
+
+
+def get_decompiler(text_encode, pad_size) -> Decompiler:
+    """Gets this process's decompiler for the options, creating it the first time"""
+
+    key = (text_encode, pad_size)
+    if key not in decompilers:
+        decompilers[key] = Decompiler(text_encode, pad_size)
+
+    return decompilers[key]
+
+
+def compile_request(params) -> dict:
+    """Compiles "source" text, or the file at "path" with its includes rebuilt only if they changed, returning the
+    bytes as base64 "data" or writing them to "output" """
+
+    include_dirs = params.get("include_dirs", [])
+    if type(include_dirs) != list or not all(type(directory) == str for directory in include_dirs):
+        raise RequestError(INVALID_PARAMS, "include_dirs must be a list of paths")
+
+    hw = get_compiler(*read_options(params), include_dirs)
+
+    try:
+        if "source" in params:
+            byte_array = hw.compile(params["source"], params.get("path"))
+        else:
+            byte_array = hw.compile_file(params["path"])
+
+    except Exception as err:
+        raise RequestError(COMPILE_ERROR, compile_error_message(err))
+
+    if "output" in params:
+        write_atomic(params["output"], byte_array)
+        return {"output": params["output"], "size": len(byte_array)}
+
+    return {"data": base64.b64encode(byte_array).decode(), "size": len(byte_array)}
+
+
+def decompile_request(params) -> dict:
+    """Decompiles base64 "data", or the file at "path", with the "rules" or the rules file at "rules_path", returning
+    the hw script as "text" or writing it to "output" """
+
+    hw = get_decompiler(*read_options(params))
+
+    if "rules" in params:
+        rules = params["rules"]
+    else:
+        with open(params["rules_path"]) as fp:
+            rules = json.load(fp)
+
+    if "data" in params:
+        try:
+            binary = base64.b64decode(params["data"], validate=True)
+        except ValueError as err:
+            raise RequestError(INVALID_PARAMS, "data is not base64: %s" % err)
+    else:
+        with open(params["path"], "rb") as fp:
+            binary = map_file(fp)
+
+    try:
+        text = "".join(hw.iter_script(rules, binary))
+    except Exception as err:
+        raise RequestError(DECOMPILE_ERROR, decompile_error_message(err))
+
+    if "output" in params:
+        write_atomic(params["output"], text.encode(hw.text_encode))
+        return {"output": params["output"], "size": len(binary)}
+
+    return {"text": text, "size": len(binary)}
+
+
+METHODS = {
+    "compile": compile_request,
+    "decompile": decompile_request,
+    "ping": lambda params: "pong",
+}
+
+# The params each method needs, one of each tuple
+REQUIRED_PARAMS = {
+    "compile": [("source", "path")],
+    "decompile": [("data", "path"), ("rules", "rules_path")],
+    "ping": [],
+}
+
+
+def handle(request) -> dict:
+    """Answers a JSON-RPC request object with a response object"""
+
+    request_id = request.get("id") if type(request) == dict else None
+
+    try:
+        if type(request) != dict or type(request.get("method")) != str:
+            raise RequestError(INVALID_REQUEST, "Requests must be objects with a method")
+
+        if request["method"] not in METHODS:
+            raise RequestError(METHOD_NOT_FOUND, "Unknown method: %s" % request["method"])
+
+        params = request.get("params", {})
+        if type(params) != dict:
+            raise RequestError(INVALID_PARAMS, "params must be an object")
+
+        for names in REQUIRED_PARAMS[request["method"]]:
+            if not any(name in params for name in names):
+                raise RequestError(INVALID_PARAMS, "Missing param: " + " or ".join(names))
+
+        try:
+            result = METHODS[request["method"]](params)
+        except OSError as err:
+            raise RequestError(INVALID_PARAMS, str(err))
+
+    except RequestError as err:
+        return {"jsonrpc": "2.0", "id": request_id, "error": {"code": err.code, "message": str(err)}}
+
+    # Anything else is still answered with the request's id, so a client sending several requests can match it
+    except Exception as err:
+        return {"jsonrpc": "2.0", "id": request_id, "error": {"code": INTERNAL_ERROR, "message": "Error: %s" % err}}
+
+    return {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+
+class Server:
+    """Answers JSON-RPC requests sent one JSON object per line over a Unix socket or stdin and stdout, requests are
+    run in jobs worker processes that keep their compilers between requests, responses are sent as each finishes
+    with the id of its request"""
+
+    def __init__(self, jobs=1, cache_dir=None):
+        if jobs > 1:
+            from concurrent.futures import ProcessPoolExecutor
+            self.executor = ProcessPoolExecutor(jobs, initializer=init_worker, initargs=(cache_dir, True))
+        else:
+            # A single worker thread, so one compiler is never used by two requests at once
+            self.executor = ThreadPoolExecutor(1, initializer=init_worker, initargs=(cache_dir,))
+
+    def serve_stream(self, reader, writer):
+        """Answers each line read from a binary reader, writing the responses to a binary writer, until the reader
+        ends and every response has been written"""
+
+        lock = threading.Lock()
+        pending = []
+
+        def respond(response):
+            line = json.dumps(response).encode() + b"\n"
+            with lock:
+                try:
+                    writer.write(line)
+                    writer.flush()
+                except (OSError, ValueError):
+                    # The client went away, its other responses are dropped too
+                    pass
+
+        def done(future):
+            try:
+                respond(future.result())
+            except Exception as err:
+                respond({"jsonrpc": "2.0", "id": None, "error": {"code": INVALID_REQUEST, "message": str(err)}})
+
+        for line in reader:
+            if not line.strip():
+                continue
+
+            try:
+                request = json.loads(line)
+            except ValueError as err:
+                respond({"jsonrpc": "2.0", "id": None, "error": {"code": PARSE_ERROR, "message": str(err)}})
+                continue
+
+            future = self.executor.submit(handle, request)
+            future.add_done_callback(done)
+            pending.append(future)
+
+            # Forget the requests already answered, so a long connection does not keep every future
+            if len(pending) > 1024:
+                pending = [future for future in pending if not future.done()]
+
+        wait(pending)
+
+    def serve_socket(self, path):
+        """Listens on a Unix socket, answering the requests of each connection until interrupted"""
+
+        if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+            raise OSError("Unix sockets are not supported on this platform, use stdio instead")
+
+        remove_stale_socket(path)
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                server.serve_stream(self.rfile, self.wfile)
+
+        with socketserver.ThreadingUnixStreamServer(path, Handler) as listener:
+            listener.daemon_threads = True
+            try:
+                listener.serve_forever()
+            finally:
+                os.remove(path)
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def remove_stale_socket(path):
+    """Removes a socket file left by a server that is no longer running, raising OSError if one still is"""
+
+    if not os.path.exists(path):
+        return
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.remove(path)
+        return
+    finally:
+        probe.close()
+
+    raise OSError("A server is already listening on %s" % path)
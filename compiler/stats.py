@@ -0,0 +1,87 @@
+import time
+from collections import Counter
+
+
+class Stats:
+    """Counts what a scan, compile or decompile did and how long each phase took, pass one to a Parser, Compiler
+    or Decompiler to collect it, nothing is counted when they have none"""
+
+    def __init__(self):
+        # Tokens scanned and bytes emitted for each group
+        self.tokens = Counter()
+        self.emitted = Counter()
+
+        # Records decoded for each struct and the deepest struct nesting
+        self.records = Counter()
+        self.max_depth = 0
+
+        # Seconds spent in each phase, the time of a compile or decompile outside of the other phases is its
+        # encode or decode time
+        self.times = Counter()
+
+    def timed(self, phase, iterable):
+        """Yields from an iterable, adding the time spent getting each item to phase, returning what it returns"""
+
+        iterator = iter(iterable)
+        times = self.times
+        clock = time.perf_counter
+
+        while True:
+            start = clock()
+            try:
+                item = next(iterator)
+            except StopIteration as stop:
+                times[phase] += clock() - start
+                return stop.value
+
+            times[phase] += clock() - start
+            yield item
+
+    def timed_call(self, phase, function):
+        """Wraps a function so the time spent in it is added to phase"""
+
+        times = self.times
+        clock = time.perf_counter
+
+        def wrapper(*args):
+            start = clock()
+            try:
+                return function(*args)
+            finally:
+                times[phase] += clock() - start
+
+        return wrapper
+
+    def to_dict(self) -> dict:
+        """Converts the stats to a dictionary that can be dumped as JSON"""
+
+        return {
+            "tokens": dict(self.tokens),
+            "emitted": dict(self.emitted),
+            "records": dict(self.records),
+            "max_depth": self.max_depth,
+            "times": dict(self.times),
+        }
+
+    def summary(self) -> str:
+        """Formats the stats as a table for printing"""
+
+        lines = []
+
+        if self.times:
+            lines.append("Time per phase:")
+            for phase, seconds in self.times.items():
+                lines.append("    %-12s %10.4fs" % (phase, seconds))
+
+        if self.tokens:
+            lines.append("Tokens scanned and bytes emitted per group:")
+            for group, count in self.tokens.most_common():
+                lines.append("    %-18s %10d %12d" % (group, count, self.emitted[group]))
+
+        if self.records:
+            lines.append("Records decoded per struct:")
+            for name, count in self.records.most_common():
+                lines.append("    %-18s %10d" % (name, count))
+            lines.append("Deepest struct nesting: %d" % self.max_depth)
+
+        return "\n".join(lines)
@@ -0,0 +1,103 @@
+from compiler.compiler import Compiler
+from compiler.decompiler import Decompiler
+from compiler.regexparser import join_chunks
+
+
+class DecompileError(Exception):
+    """Raised by verify when the binary data cannot be decompiled, error is what the decompiler raised, so it is
+    not mistaken for the decompiled output failing to compile"""
+
+    def __init__(self, error):
+        Exception.__init__(self, error)
+        self.error = error
+
+
+def iter_decoded(lines):
+    """Yields the decompiled lines, raising DecompileError if decompiling them fails"""
+
+    try:
+        yield from lines
+    except Exception as err:
+        raise DecompileError(err) from err
+
+
+class CompareStream:
+    """A binary stream that compares everything written to it against the original bytes instead of keeping it"""
+
+    class Mismatch(Exception):
+        def __init__(self, offset, expected, actual, path=()):
+            super().__init__(offset, expected, actual)
+            self.offset = offset
+            self.expected = expected
+            self.actual = actual
+
+            # The (step or record, offset it starts at) that decoded the byte, empty if it was left over
+            self.path = path
+
+        def __str__(self):
+            if self.actual is None:
+                message = "Output ends early at offset %d, expected #%02x" % (self.offset, self.expected)
+            elif self.expected is None:
+                message = "Output has extra bytes from offset %d, got #%02x" % (self.offset, self.actual)
+            else:
+                message = "First mismatch at offset %d, expected #%02x got #%02x" % (
+                    self.offset, self.expected, self.actual)
+
+            if self.expected is None:
+                return message
+            elif self.path:
+                return message + " in " + " > ".join(name for name, _ in self.path)
+            return message + " in the left over bytes"
+
+    def __init__(self, binary):
+        self.view = memoryview(binary)
+        self.offset = 0
+
+    def write(self, byte_array) -> int:
+        """Compares the bytes with the original at the current offset, raising Mismatch at the first difference"""
+
+        end = self.offset + len(byte_array)
+        original = self.view[self.offset: end]
+
+        if original != byte_array:
+            original = bytes(original)
+            byte_array = bytes(byte_array)
+
+            index = 0
+            while index < len(original) and original[index] == byte_array[index]:
+                index += 1
+
+            raise self.Mismatch(self.offset + index, original[index] if index < len(original) else None,
+                                byte_array[index])
+
+        self.offset = end
+        return len(byte_array)
+
+    def close(self):
+        """Checks the whole original was written, raising Mismatch if the output ended early"""
+
+        if self.offset < len(self.view):
+            raise self.Mismatch(self.offset, self.view[self.offset], None)
+
+
+def verify(rules, binary, text_encode="UTF-8", pad_size=4):
+    """Checks that compiling the decompiled binary data gives back the same bytes, the decompiled script is compiled
+    as it is decoded and compared a chunk at a time, so neither is ever held in memory as a whole
+
+    Returns the first CompareStream.Mismatch with the path to the rule that decoded it, or None if they match, raises
+    DecompileError if the binary data cannot be decompiled"""
+
+    decompiler = Decompiler(text_encode, pad_size)
+    stream = CompareStream(binary)
+
+    try:
+        # The compiler scans fewer, larger chunks much faster than a line at a time
+        chunks = join_chunks(iter_decoded(decompiler.iter_script(rules, binary)))
+        Compiler(text_encode, pad_size).compile_to(chunks, stream)
+        stream.close()
+    except CompareStream.Mismatch as mismatch:
+        # Decoding runs ahead of compiling, so the rule is found by decoding again up to the mismatch
+        mismatch.path = decompiler.locate(rules, binary, mismatch.offset)
+        return mismatch
+
+    return None
@@ -0,0 +1,133 @@
+import hashlib
+import io
+import os
+import time
+
+from compiler.compiler import Compiler, Fragment
+from compiler.batch import compile_error_message
+
+
+def write_atomic(path, byte_array):
+    """Writes a file through a temporary file so readers only ever see the old or the new contents"""
+
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        with open(temp_path, "wb") as fp:
+            fp.write(byte_array)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def stat_key(path):
+    """Gets what changes when a file is saved, or None if it cannot be read"""
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return stat.st_mtime_ns, stat.st_size
+
+
+class Watcher:
+    """Keeps outputs compiled from their source files, each target is (source files, output file) and is only
+    compiled again when one of its sources or a file they include changes
+
+    The compiler is kept between checks, so its tokenizers are only built once and unchanged files are never read
+    again, it should have a cache so files are built as fragments"""
+
+    def __init__(self, hw, targets):
+        self.hw = hw
+        self.targets = [([os.path.abspath(source) for source in sources], output) for sources, output in targets]
+
+        # The Fragment each output of several sources was last built as, kept like the compiler keeps its files
+        self.joined = {}
+
+        # The fragment keys each output was last written from
+        self.written = {}
+
+        # The stats of the files a failed output read, it is not tried again until one of them changes
+        self.failed = {}
+
+    def check(self):
+        """Compiles every target whose sources changed, yielding (output, error message or None, seconds taken)
+        for each one compiled"""
+
+        for sources, output in self.targets:
+            if output in self.failed:
+                paths, stats = self.failed[output]
+                if [stat_key(path) for path in paths] == stats:
+                    continue
+
+            start = time.perf_counter()
+
+            try:
+                fragment = self.hw.build(sources[0]) if len(sources) == 1 else self.build_joined(sources, output)
+                keys = [fragment.key]
+
+                if self.written.get(output) == keys:
+                    continue
+
+                write_atomic(output, fragment.byte_array)
+
+            # Any error is reported and the target tried again once a file changes, a typo should never stop the watch
+            except Exception as err:
+                self.written.pop(output, None)
+
+                # Any of the files built so far could be what fixes it
+                paths = sources + [path for path in self.hw.fragments if path not in sources]
+                if isinstance(err, Compiler.IncludeError) and err.path not in paths:
+                    paths.append(err.path)
+
+                self.failed[output] = (paths, [stat_key(path) for path in paths])
+                yield output, compile_error_message(err), time.perf_counter() - start
+                continue
+
+            self.failed.pop(output, None)
+            self.written[output] = keys
+            yield output, None, time.perf_counter() - start
+
+    def build_joined(self, sources, output) -> Fragment:
+        """Compiles several sources as one text, as the command line does, so names defined in one source can be
+        used in the next, only compiling them again if a source or a file they include changed"""
+
+        stats = [stat_key(source) for source in sources]
+        fragment = self.joined.get(output)
+
+        # Unchanged sources only need compiling again if one of their includes changed
+        if fragment is not None and fragment.stat == stats:
+            includes = [(include, self.hw.build(include).key) for include, _ in fragment.includes]
+            if includes == fragment.includes:
+                return fragment
+
+        text = "".join(self.hw.read_include(source) for source in sources)
+        fragment = Fragment(None, stats, hashlib.sha256(text.encode("UTF-8", "surrogatepass")).hexdigest())
+
+        stream = io.BytesIO()
+        self.hw.encode_to(text, stream, None, fragment)
+        fragment.byte_array = stream.getvalue()
+        fragment.key = self.hw.fragment_key(fragment.digest, fragment.includes)
+
+        self.joined[output] = fragment
+        return fragment
+
+    def run(self, interval=0.1, report=print):
+        """Checks the targets every interval seconds until interrupted, reporting each output compiled"""
+
+        try:
+            while True:
+                for output, error, seconds in self.check():
+                    if error is None:
+                        report("Compiled %s in %.1fms" % (output, seconds * 1000))
+                    else:
+                        report("%s: %s" % (output, error))
+
+                time.sleep(interval)
+
+        except KeyboardInterrupt:
+            pass
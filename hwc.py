@@ -0,0 +1,8 @@
+"""Headless command line entry point, the same as cli.py but kept small so Python can use the cached bytecode of the
+cli module instead of compiling it on every run, and it never imports the UI"""
+
+from cli import command_line_interface
+
+
+if __name__ == "__main__":
+    command_line_interface()
@@ -1,4 +1,3 @@
-from UI.app import App
 from cli import command_line_interface
 import sys
 import os
@@ -10,6 +9,9 @@ def main():
     if len(sys.argv) > 1:
         command_line_interface()
     else:
+        # The UI is only imported when it is shown, so the command line never needs tkinter
+        from UI.app import App
+
         app = App(f"{dir_path}/style.style")
         app.run()
 